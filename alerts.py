@@ -0,0 +1,149 @@
+import json
+import os
+import tempfile
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+class TradingCalendar:
+    """
+    PSX trading sessions, taken from the dates that actually have bars in the store
+    (so exchange holidays and closures are skipped without a holiday table).
+    """
+    def __init__(self, sessions):
+        self.sessions = pd.DatetimeIndex(sessions).normalize().unique().sort_values()
+
+    @classmethod
+    def from_frames(cls, frames):
+        """Calendar of every date on which any symbol of {symbol: dataframe} has a bar."""
+        dates = [df.index.values for df in frames.values()]
+        return cls(np.concatenate(dates) if dates else [])
+
+    def session_index(self, dates):
+        """Position of each date's session (the last session on or before it); -1 before the first."""
+        dates = pd.DatetimeIndex(np.atleast_1d(dates)).normalize()
+        return np.searchsorted(self.sessions.values, dates.values, side='right') - 1
+
+    def sessions_between(self, start, end):
+        """Trading sessions from each `start` to `end` (0 on the same session)."""
+        return self.session_index(end) - self.session_index(start)
+
+def cooldown_mask(session_numbers, cooldown_sessions):
+    """
+    Replays a cooldown over one symbol's signal sessions (sorted session indices).
+    Returns a boolean mask of the signals that would alert: the first one, and any
+    that come at least `cooldown_sessions` after the last alerted one (signals on
+    the alerted session itself all pass, as several zones can break on one day).
+    """
+    keep = np.zeros(len(session_numbers), dtype=bool)
+    last = None
+    for n, session in enumerate(session_numbers):
+        if last is None or session == last or session - last >= cooldown_sessions:
+            keep[n] = True
+            last = session
+    return keep
+
+class AlertManager:
+    """
+    Alert history backed by an append-only journal.
+
+    `alert_history.json` holds the compacted snapshot ({symbol: {date, level, score}});
+    every alert is appended as one JSON line to the journal next to it
+    (`alert_history.jsonl`), so logging an alert never rewrites the history.
+    compact() folds the journal into a new snapshot (temp file + rename) and
+    empties it. On startup the snapshot and journal are replayed once into an
+    in-memory symbol -> last alert index, so cooldown checks are lookups.
+    """
+    def __init__(self, filepath, journal_path=None):
+        self.filepath = Path(filepath)
+        self.journal_path = Path(journal_path) if journal_path else self.filepath.with_suffix(".jsonl")
+        self.history = self._load_history()
+        self._replay_journal()
+        self.last_alert = pd.Series(
+            {symbol: self._parse_date(entry) for symbol, entry in self.history.items()},
+            dtype='datetime64[ns]'
+        )
+
+    def _load_history(self):
+        """Loads JSON history. Returns empty dict if file is missing/corrupt."""
+        if self.filepath.exists():
+            try:
+                with open(self.filepath, 'r') as f:
+                    return json.load(f)
+            except json.JSONDecodeError:
+                print("⚠️ History file corrupted. Starting fresh.")
+                return {}
+        return {}
+
+    def _replay_journal(self):
+        """Applies journal entries newer than the snapshot."""
+        if not self.journal_path.exists():
+            return
+        with open(self.journal_path, 'rb+') as f:
+            data = f.read()
+            # A crash mid-append leaves a torn last line: cut it so the next append starts clean
+            if data and not data.endswith(b"\n"):
+                data = data[:data.rfind(b"\n") + 1]
+                f.truncate(len(data))
+        for line in data.decode().splitlines():
+            try:
+                entry = json.loads(line)
+                self.history[entry.pop('symbol')] = entry
+            except (ValueError, KeyError, AttributeError):
+                continue
+
+    @staticmethod
+    def _parse_date(entry):
+        try:
+            return datetime.fromisoformat(entry['date'])
+        except (ValueError, KeyError, TypeError):
+            return pd.NaT # Invalid date format in file, never cooling down
+
+    def cooling_down_mask(self, symbols, cooldown_days=5, now=None, calendar=None):
+        """
+        Boolean array: which of `symbols` were alerted less than `cooldown_days` days ago.
+        With a TradingCalendar the cooldown counts trading sessions instead of calendar days.
+        """
+        now = np.datetime64(now or datetime.now(), 'ns')
+        last = self.last_alert.reindex(list(symbols)).to_numpy()
+        if calendar is None:
+            return (now - last) < np.timedelta64(cooldown_days, 'D')
+        alerted = ~np.isnat(last)
+        elapsed = calendar.session_index(now) - calendar.session_index(np.where(alerted, last, now))
+        return alerted & (elapsed < cooldown_days)
+
+    def is_cooling_down(self, symbol, cooldown_days=5):
+        """Returns True if symbol was alerted recently."""
+        return bool(self.cooling_down_mask([symbol], cooldown_days)[0])
+
+    def log_alert(self, symbol, data):
+        """Appends the alert to the journal and updates the index."""
+        entry = {
+            "date": datetime.now().isoformat(),
+            "level": data['level'],
+            "score": data.get('compression_score', 0)
+        }
+        with open(self.journal_path, 'a') as f:
+            f.write(json.dumps(dict(entry, symbol=symbol)) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self.history[symbol] = entry
+        self.last_alert[symbol] = self._parse_date(entry)
+
+    def compact(self):
+        """
+        Writes the full history as the new snapshot and clears the journal.
+        The snapshot is replaced atomically; a crash before the journal is cleared
+        only means the same entries are replayed again on the next start.
+        """
+        if not self.journal_path.exists():
+            return
+        fd, tmp_path = tempfile.mkstemp(dir=self.filepath.parent or ".", suffix=".tmp")
+        with os.fdopen(fd, 'w') as f:
+            json.dump(self.history, f, indent=4)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.filepath)
+        self.journal_path.unlink()
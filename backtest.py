@@ -1,82 +1,265 @@
+import argparse
 import pandas as pd
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor
 from tqdm import tqdm # You might need to pip install tqdm
 import matplotlib.pyplot as plt
 from pipeline import PSXDataPipeline
-from scanner import StructuralScanner
+from providers import make_provider
+from scanner import StructuralScanner, allocate_metrics
+from alerts import TradingCalendar, cooldown_mask
+from evaluator import classify_regime, regimes_on, gate_signals
 
 # Configuration
 BACKTEST_YEARS = 2
 HOLDING_PERIODS = [5, 10, 20] # Check returns after 5, 10, and 20 days
+HEADLINE_PERIOD = 10 # Horizon used for the win rate and the top/worst lists (if tested)
 MIN_LIQUIDITY = 10_000_000
 
+def parse_horizons(text):
+    """Parses holding periods such as '5,10,20' or '1-60' (ranges are inclusive)."""
+    horizons = set()
+    for part in text.split(","):
+        first, _, last = part.strip().partition("-")
+        horizons.update(range(int(first), int(last or first) + 1))
+    if not horizons or min(horizons) < 1:
+        raise ValueError(f"Holding periods must be positive: {text}")
+    return sorted(horizons)
+
+def _scan_loop(df, start_index, end_index, with_zones=False, clustering="legacy", annotate=False):
+    """
+    Legacy engine: one scanner per simulated day. Returns {day_index: candidates}
+    (with with_zones, also {day_index: structural zones}, like scan_history).
+    With annotate, each day runs the original pandas scanner on a copy of its slice:
+    the reference the faster engines are checked against.
+    """
+    signals, signal_zones = {}, {}
+    # One set of indicator buffers for the whole replay; each day's scanner fills a prefix of it
+    buffers = None if annotate else allocate_metrics(len(df))
+
+    # 3. Time Travel Loop
+    for i in range(start_index, end_index):
+        # Slice the dataframe to simulate "Today is day i"
+        # We interpret df.iloc[i] as "Today's Close"
+        df_past = df.iloc[:i+1]
+        
+        # Run the Scanner (annotate=False: reads the slice, never writes into it)
+        if annotate:
+            scanner = StructuralScanner(df_past.copy(), min_liquidity_pkr=MIN_LIQUIDITY, zone_clustering=clustering)
+        else:
+            scanner = StructuralScanner(df_past, min_liquidity_pkr=MIN_LIQUIDITY, zone_clustering=clustering,
+                                        annotate=False, buffers={name: b[:i+1] for name, b in buffers.items()})
+        
+        # We catch the candidates
+        result = scanner.scan()
+        
+        if result.candidates:
+            signals[i] = result.candidates
+            signal_zones[i] = result.zones
+    if with_zones:
+        return signals, signal_zones
+    return signals
+
+def _production_gate(df, signals, zones, regimes):
+    """
+    Applies AgenticEvaluator.evaluate_signal's filters to every candidate of the replay
+    at once: each candidate is joined with the regime of its date and the zones of its
+    day (a NaN-padded matrix), then gate_signals() runs as array operations.
+    Returns the accepted signals, each tagged with its regime and upside.
+    """
+    days = np.array(sorted(signals))
+    counts = np.array([len(signals[i]) for i in days])
+    candidates = [c for i in days for c in signals[i]]
+    owner = np.repeat(np.arange(len(days)), counts) # Candidate -> row of its day
+
+    width = max(len(zones[i]) for i in days)
+    day_zones = np.full((len(days), width), np.nan)
+    for row, i in enumerate(days):
+        day_zones[row, :len(zones[i])] = [z['level'] for z in zones[i]]
+
+    status, vol_mult = regimes_on(regimes, df.index[days])
+    accepted, _, upside = gate_signals(
+        [c['level'] for c in candidates],
+        [c['vol_expansion'] for c in candidates],
+        day_zones[owner], status[owner], vol_mult[owner]
+    )
+
+    gated = {}
+    for n in np.flatnonzero(accepted):
+        day = owner[n]
+        gated.setdefault(int(days[day]), []).append(dict(candidates[n], regime=status[day], upside=upside[n]))
+    return gated
+
+def forward_closes(close, days, horizons):
+    """
+    Close `h` bars after each of `days`, for every horizon `h`, as one gather over a
+    (days x horizons) index matrix. Horizons past the last bar are NaN.
+    """
+    close = np.append(np.asarray(close, dtype=float), np.nan) # Sentinel for "not yet known"
+    ahead = np.asarray(days)[:, None] + np.asarray(horizons)[None, :]
+    return close[np.minimum(ahead, len(close) - 1)]
+
+def _outcomes(symbol, df, signals, horizons):
+    """Result rows for every candidate of {day_index: candidates}, in date order."""
+    days = sorted(signals)
+    candidates = [(i, signal) for i in days for signal in signals[i]]
+    if not candidates:
+        return []
+
+    # 4. Calculate The Outcome (The "Peek" into the future)
+    # Assuming we bought the breakout level (or use the closing price: df['close'].iloc[i])
+    entry_price = np.array([signal['level'] for _, signal in candidates])
+    future_close = forward_closes(df['close'].values, [i for i, _ in candidates], horizons)
+    returns = (future_close - entry_price[:, None]) / entry_price[:, None]
+
+    rows = []
+    for (i, signal), signal_returns in zip(candidates, returns):
+        row = {
+            'Date': df.index[i].date(),
+            'Symbol': symbol,
+            'Signal_Score': signal['compression_score'],
+            'Vol_Expansion': signal['vol_expansion']
+        }
+        if 'regime' in signal:
+            row['Regime'] = signal['regime']
+            row['Upside'] = signal['upside'] # NaN = Blue Sky
+        # NaN where the horizon runs past the end of the data
+        row.update({f'Return_{h}D': r for h, r in zip(horizons, signal_returns)})
+        rows.append(row)
+    return rows
+
+def backtest_symbol(symbol, df, engine="vectorized", cooldown_sessions=0, calendar=None,
+                    gate="scanner", regimes=None, horizons=HOLDING_PERIODS, clustering="legacy"):
+    """
+    Runs the full simulation for one symbol. Returns its result rows in date order,
+    with the return after each of `horizons` bars (NaN while it is still in the future).
+    With gate='production', candidates also go through the evaluator's regime and
+    location filters, using `regimes` (classify_regime() of the index; None = NEUTRAL).
+    With cooldown_sessions, signals within that many trading sessions (of `calendar`,
+    default: the symbol's own bars) after an alerted one are dropped, as in the live scan.
+    `clustering` is the scanner's zone_clustering mode.
+    """
+    if len(df) < 250: return [] # Skip young stocks
+
+    # We start from index 200 to ensure enough data for moving averages
+    # We run up to the last date: outcomes that are not known yet are NaN
+    start_index = len(df) - (250 * BACKTEST_YEARS)
+    if start_index < 200: start_index = 200
+    
+    end_index = len(df)
+
+    with_zones = gate == "production"
+    if engine in ("loop", "reference"):
+        signals = _scan_loop(df, start_index, end_index, with_zones, clustering, annotate=engine == "reference")
+    else:
+        # Read-only views of df's columns; indicators go into the scanner's own arrays
+        scanner = StructuralScanner(df, min_liquidity_pkr=MIN_LIQUIDITY, zone_clustering=clustering, annotate=False)
+        signals = scanner.scan_history(start_index, end_index, with_zones=with_zones)
+
+    if with_zones:
+        signals, zones = signals
+        if signals:
+            signals = _production_gate(df, signals, zones, regimes)
+
+    if cooldown_sessions and signals:
+        calendar = calendar or TradingCalendar.from_frames({symbol: df})
+        days = sorted(signals)
+        keep = cooldown_mask(calendar.session_index(df.index[days]), cooldown_sessions)
+        signals = {i: signals[i] for i, kept in zip(days, keep) if kept}
+
+    return _outcomes(symbol, df, signals, horizons)
+
+# Per-process options shared by every task: set once per worker by the pool initializer,
+# so the universe calendar and the regime series are not pickled again for each symbol
+_WORKER_OPTIONS = {}
+
+def _init_worker(options):
+    _WORKER_OPTIONS.update(options)
+
+def _backtest_worker(symbol, df):
+    return backtest_symbol(symbol, df, **_WORKER_OPTIONS)
+
 class Backtester:
-    def __init__(self):
-        self.pipeline = PSXDataPipeline()
+    def __init__(self, engine="vectorized", workers=1, from_store=False, pipeline=None, cooldown_sessions=0,
+                 gate="scanner", horizons=HOLDING_PERIODS, zone_clustering="legacy"):
+        """
+        Args:
+            engine (str): 'vectorized' computes indicators once per symbol and replays
+                every day in a single pass; 'loop' re-runs the scanner on each daily slice;
+                'reference' does so with the original pandas indicators (slowest).
+            workers (int): Number of processes to fan symbols out to (1 = serial).
+            from_store (bool): Load the universe from the local columnar store instead of downloading.
+            pipeline (PSXDataPipeline): Data pipeline to use (default: live Yahoo data).
+            cooldown_sessions (int): Apply the live alert cooldown, in trading sessions (0 = off).
+            gate (str): 'scanner' keeps every scanner candidate; 'production' also applies the
+                evaluator's regime and location filters, with the regime of each signal's date.
+            horizons (list): Holding periods, in bars, to measure forward returns over.
+            zone_clustering (str): Scanner zone clustering, 'legacy' (as live) or 'sorted'.
+        """
+        self.pipeline = pipeline or PSXDataPipeline()
+        self.engine = engine
+        self.workers = workers
+        self.from_store = from_store
+        self.cooldown_sessions = cooldown_sessions
+        self.gate = gate
+        self.horizons = sorted(set(horizons))
+        self.zone_clustering = zone_clustering
         self.results = []
 
     def run(self):
         # 1. Fetch Data
         print("📥 Fetching historical data...")
-        # Force a fresh update to ensure we have full history
-        data_cache = self.pipeline.update_universe()
+        if self.from_store:
+            data_cache = self.pipeline.load_universe()
+        else:
+            # Force a fresh update to ensure we have full history
+            data_cache = self.pipeline.update_universe()
         
+        # Sessions are counted on the universe's calendar, as in the live scan
+        calendar = TradingCalendar.from_frames(data_cache) if self.cooldown_sessions else None
+
+        # Regime of every date, from the stored KSE-100 history (classified once)
+        regimes = None
+        if self.gate == "production":
+            df_index = self.pipeline.get_market_regime()
+            if df_index is not None and not df_index.empty:
+                regimes = classify_regime(df_index)
+            else:
+                print("⚠️ No KSE-100 history: every date is evaluated as NEUTRAL.")
+
         print(f"🔄 Starting Backtest on {len(data_cache)} symbols...")
         print("⏳ This simulates every single day for the past 2 years. It may take a few minutes.")
 
         # 2. Iterate through every stock
-        for symbol, df in tqdm(data_cache.items(), desc="Analyzing Universe"):
-            if len(df) < 250: continue # Skip young stocks
-
-            # We start from index 200 to ensure enough data for moving averages
-            # We end 20 days before the last date so we can calculate the outcome
-            start_index = len(df) - (250 * BACKTEST_YEARS)
-            if start_index < 200: start_index = 200
-            
-            end_index = len(df) - 20 
-
-            # 3. Time Travel Loop
-            for i in range(start_index, end_index):
-                # Slice the dataframe to simulate "Today is day i"
-                # We interpret df.iloc[i] as "Today's Close"
-                
-                # OPTIMIZATION: 
-                # Calculating zones is heavy. We only run the full scanner 
-                # if the price is effectively moving (Volatility check) 
-                # to speed up the loop.
-                
-                # Create the 'past' view
-                df_past = df.iloc[:i+1].copy()
-                
-                # Run the Scanner
-                scanner = StructuralScanner(df_past, min_liquidity_pkr=MIN_LIQUIDITY)
-                
-                # We catch the candidates
-                candidates = scanner.evaluate_breakout()
-                
-                if candidates:
-                    for signal in candidates:
-                        # 4. Calculate The Outcome (The "Peek" into the future)
-                        entry_price = signal['level'] # Assuming we bought the breakout level
-                        # Or use closing price: entry_price = df.iloc[i]['close']
-                        
-                        future_close_5 = df.iloc[i+5]['close']
-                        future_close_10 = df.iloc[i+10]['close']
-                        future_close_20 = df.iloc[i+20]['close']
-                        
-                        res_5d = (future_close_5 - entry_price) / entry_price
-                        res_10d = (future_close_10 - entry_price) / entry_price
-                        res_20d = (future_close_20 - entry_price) / entry_price
-
-                        self.results.append({
-                            'Date': df.index[i].date(),
-                            'Symbol': symbol,
-                            'Signal_Score': signal['compression_score'],
-                            'Vol_Expansion': signal['vol_expansion'],
-                            'Return_5D': res_5d,
-                            'Return_10D': res_10d,
-                            'Return_20D': res_20d
-                        })
+        # Symbols are independent; results are merged in universe order either way,
+        # so the parallel run produces exactly the same rows as the serial one.
+        options = {
+            'engine': self.engine,
+            'cooldown_sessions': self.cooldown_sessions,
+            'calendar': calendar,
+            'gate': self.gate,
+            'regimes': regimes,
+            'horizons': self.horizons,
+            'clustering': self.zone_clustering
+        }
+        if self.workers > 1:
+            # Shared options go to each worker once; frames go as plain pickles, a few
+            # symbols per task, serialized only as the pool feeds its workers
+            symbols = list(data_cache)
+            chunksize = max(1, len(symbols) // (self.workers * 4))
+            with ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                     initargs=(options,)) as pool:
+                per_symbol = pool.map(
+                    _backtest_worker,
+                    symbols,
+                    (data_cache[s] for s in symbols),
+                    chunksize=chunksize
+                )
+                for rows in tqdm(per_symbol, total=len(symbols), desc="Analyzing Universe"):
+                    self.results.extend(rows)
+        else:
+            for symbol, df in tqdm(data_cache.items(), desc="Analyzing Universe"):
+                self.results.extend(backtest_symbol(symbol, df, **options))
 
     def analyze(self):
         if not self.results:
@@ -90,26 +273,67 @@ class Backtester:
         print("="*40)
         print(f"Total Signals: {len(df_res)}")
         
-        # Win Rate (Positive return after 10 days)
-        win_rate = len(df_res[df_res['Return_10D'] > 0]) / len(df_res) * 100
-        avg_return = df_res['Return_10D'].mean() * 100
+        # Per-horizon stats over the signals whose horizon has already played out
+        returns = df_res[[f'Return_{h}D' for h in self.horizons]]
+        known = returns.notna().sum()
+        summary = pd.DataFrame({
+            'Signals': known.values,
+            'Win Rate %': ((returns > 0).sum() / known.replace(0, np.nan) * 100).round(1).values,
+            'Avg Return %': (returns.mean() * 100).round(2).values
+        }, index=pd.Index(self.horizons, name='Days'))
+        print(summary.to_string())
+
+        # Win Rate (Positive return after 10 days, or the first tested horizon)
+        headline = HEADLINE_PERIOD if HEADLINE_PERIOD in self.horizons else self.horizons[0]
+        column = f'Return_{headline}D'
+        win_rate, avg_return = summary.loc[headline, 'Win Rate %'], summary.loc[headline, 'Avg Return %']
         
-        print(f"🎯 Win Rate (10-Day): {win_rate:.1f}%")
-        print(f"📈 Avg Return (10-Day): {avg_return:.2f}%")
+        print(f"\n🎯 Win Rate ({headline}-Day): {win_rate:.1f}%")
+        print(f"📈 Avg Return ({headline}-Day): {avg_return:.2f}%")
         
-        # Best Performers
+        # Best Performers (signals still inside the horizon are left out)
+        ranked = df_res.dropna(subset=[column])
         print("\n🏆 Top Performing Signals:")
-        print(df_res.sort_values(by='Return_10D', ascending=False)[['Date', 'Symbol', 'Return_10D']].head(5))
+        print(ranked.sort_values(by=column, ascending=False)[['Date', 'Symbol', column]].head(5))
 
         # Worst Performers
         print("\n💀 Worst Failures:")
-        print(df_res.sort_values(by='Return_10D', ascending=True)[['Date', 'Symbol', 'Return_10D']].head(5))
+        print(ranked.sort_values(by=column, ascending=True)[['Date', 'Symbol', column]].head(5))
         
         # Export
         df_res.to_csv("backtest_results.csv", index=False)
         print("\n💾 Detailed logs saved to 'backtest_results.csv'")
 
 if __name__ == "__main__":
-    tester = Backtester()
+    parser = argparse.ArgumentParser(description="Replay the structural breakout scanner over history.")
+    parser.add_argument("--engine", choices=["vectorized", "loop", "reference"], default="vectorized")
+    parser.add_argument("--workers", type=int, default=1, help="Process pool size (1 = serial)")
+    parser.add_argument("--from-store", action="store_true", help="Use the local universe store (no download)")
+    parser.add_argument("--provider", choices=["yahoo", "local", "synthetic"], default="yahoo")
+    parser.add_argument("--data-path", default="./fixtures", help="Fixture directory for --provider local")
+    parser.add_argument("--symbols", type=int, default=30, help="Universe size for --provider synthetic")
+    parser.add_argument("--years", type=int, default=BACKTEST_YEARS, help="History to load, in years")
+    parser.add_argument("--cooldown-sessions", type=int, default=0,
+                        help="Mute a symbol for this many trading sessions after a signal, like the live scan (0 = off)")
+    parser.add_argument("--horizons", default=",".join(map(str, HOLDING_PERIODS)),
+                        help="Holding periods in days, e.g. '5,10,20' or '1-60'")
+    parser.add_argument("--zone-clustering", choices=["legacy", "sorted"], default="legacy",
+                        help="Zone clustering mode; 'legacy' matches the live scan")
+    parser.add_argument("--gate", choices=["scanner", "production"], default="scanner",
+                        help="'production' also applies the evaluator's regime and location filters")
+    args = parser.parse_args()
+    horizons = parse_horizons(args.horizons)
+
+    if args.provider == "local":
+        provider = make_provider("local", path=args.data_path)
+    elif args.provider == "synthetic":
+        provider = make_provider("synthetic", symbols=args.symbols, years=args.years)
+    else:
+        provider = make_provider("yahoo")
+    pipeline = PSXDataPipeline(provider=provider, history_period=f"{args.years}y")
+
+    tester = Backtester(engine=args.engine, workers=args.workers, from_store=args.from_store, pipeline=pipeline,
+                        cooldown_sessions=args.cooldown_sessions, gate=args.gate, horizons=horizons,
+                        zone_clustering=args.zone_clustering)
     tester.run()
     tester.analyze()
\ No newline at end of file
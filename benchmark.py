@@ -0,0 +1,162 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+from pipeline import PSXDataPipeline
+from providers import DataProvider, SyntheticProvider
+from scanner import StructuralScanner
+from panel import UniversePanel, LATEST_DEPTH
+from evaluator import AgenticEvaluator
+from backtest import Backtester
+import main as scan_job
+
+# Default matrix: universe sizes x years of history
+SYMBOL_COUNTS = [30, 300, 3000]
+HISTORY_YEARS = [2, 10, 20]
+STAGES = ["metrics", "panel", "panel_store", "zones", "evaluate", "regime", "backtest", "main"]
+
+class _MemoryProvider(DataProvider):
+    """Serves frames generated once up front, so data generation is not timed."""
+    def __init__(self, frames, universe):
+        self.frames = frames
+        self.universe = universe
+
+    def default_universe(self):
+        return self.universe
+
+    def download(self, tickers, period=None, start=None):
+        return {t: self.frames[t] for t in tickers if t in self.frames}
+
+def _make_pipeline(symbols, years, storage_path):
+    source = SyntheticProvider(symbols=symbols, years=years)
+    universe = source.default_universe()
+    tickers = [f"{s}.KA" for s in universe] + ["^KSE"]
+    provider = _MemoryProvider(source.download(tickers), universe)
+    return PSXDataPipeline(storage_path, provider=provider, history_period=f"{years}y")
+
+@contextlib.contextmanager
+def _quiet():
+    with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+        yield
+
+def _time(fn, setup=None, repeat=3):
+    """Runs `fn(setup())` `repeat` times. Returns the list of wall-clock seconds."""
+    timings = []
+    for _ in range(repeat):
+        arg = setup() if setup else None
+        start = time.perf_counter()
+        fn(arg)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+def run_case(stage, pipeline, frames, repeat, workdir):
+    """Benchmarks one stage on a prepared synthetic universe. Returns the timings in seconds."""
+    def fresh_scanners(_=None):
+        return [StructuralScanner(df, annotate=False) for df in frames.values()]
+
+    def primed_scanners(_=None):
+        scanners = fresh_scanners()
+        for scanner in scanners:
+            scanner._calculate_metrics()
+        return scanners
+
+    if stage == "metrics":
+        return _time(lambda scanners: [s._calculate_metrics() for s in scanners], fresh_scanners, repeat)
+    if stage == "panel":
+        return _time(lambda _: UniversePanel.from_frames(frames, depth=LATEST_DEPTH).latest_candidates(), None, repeat)
+    if stage == "panel_store":
+        # Full-history panel straight from the mapped universe store (no per-symbol frames)
+        return _time(lambda _: pipeline.load_panel().latest_candidates(), None, repeat)
+    if stage == "zones":
+        return _time(lambda scanners: [s._find_structural_zones() for s in scanners], primed_scanners, repeat)
+    if stage == "evaluate":
+        return _time(lambda scanners: [s.evaluate_breakout() for s in scanners], fresh_scanners, repeat)
+    if stage == "regime":
+        with _quiet():
+            evaluator = AgenticEvaluator(pipeline)
+        return _time(lambda _: evaluator._assess_market_regime(), None, repeat)
+    if stage == "backtest":
+        def backtest(_):
+            with _quiet():
+                Backtester(pipeline=pipeline).run()
+        return _time(backtest, None, repeat)
+    if stage == "main":
+        # Fresh working directory per repeat so the alert cooldown starts empty
+        def end_to_end(run_dir):
+            cwd = os.getcwd()
+            os.chdir(run_dir)
+            try:
+                with _quiet():
+                    scan_job.main(pipeline)
+            finally:
+                os.chdir(cwd)
+        return _time(end_to_end, lambda: tempfile.mkdtemp(dir=workdir), repeat)
+    raise ValueError(f"Unknown stage: {stage}")
+
+def _key(record):
+    return (record['stage'], record['symbols'], record['years'])
+
+def main():
+    # Benchmarks never talk to Telegram or OpenAI, whatever the local .env says
+    scan_job.TELEGRAM_BOT_TOKEN = scan_job.TELEGRAM_CHAT_ID = scan_job.OPENAI_API_KEY = None
+
+    parser = argparse.ArgumentParser(description="Benchmark scanner, evaluator and backtester hot paths on synthetic data.")
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=STAGES)
+    parser.add_argument("--symbols", nargs="+", type=int, default=SYMBOL_COUNTS)
+    parser.add_argument("--years", nargs="+", type=int, default=HISTORY_YEARS)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", help="Write results as JSON lines to this file")
+    parser.add_argument("--compare", help="Baseline JSON lines file from a previous --output run")
+    parser.add_argument("--threshold", type=float, default=1.25,
+                        help="Fail if a median is this many times slower than the baseline")
+    args = parser.parse_args()
+
+    results = []
+    print(f"{'stage':<12}{'symbols':>8}{'years':>6}{'median s':>12}{'min s':>10}{'ms/symbol':>11}")
+    for symbols in args.symbols:
+        for years in args.years:
+            with tempfile.TemporaryDirectory() as workdir:
+                pipeline = _make_pipeline(symbols, years, os.path.join(workdir, "data_store"))
+                with _quiet():
+                    frames = pipeline.update_universe()
+                for stage in args.stages:
+                    timings = run_case(stage, pipeline, frames, args.repeat, workdir)
+                    record = {
+                        'stage': stage,
+                        'symbols': symbols,
+                        'years': years,
+                        'median_s': statistics.median(timings),
+                        'min_s': min(timings),
+                        'repeat': args.repeat
+                    }
+                    results.append(record)
+                    print(f"{stage:<12}{symbols:>8}{years:>6}{record['median_s']:>12.4f}"
+                          f"{record['min_s']:>10.4f}{record['median_s'] / symbols * 1000:>11.3f}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            for record in results:
+                f.write(json.dumps(record) + "\n")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = {_key(r): r for r in map(json.loads, f)}
+        regressions = []
+        for record in results:
+            base = baseline.get(_key(record))
+            if base and record['median_s'] > base['median_s'] * args.threshold:
+                regressions.append(record)
+                print(f"❌ Regression: {record['stage']} ({record['symbols']} symbols, {record['years']}y) "
+                      f"{base['median_s']:.4f}s -> {record['median_s']:.4f}s")
+        if regressions:
+            sys.exit(1)
+        print("✅ No regressions against baseline.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+import argparse
+import contextlib
+import io
+import sys
+import tempfile
+
+import numpy as np
+import pandas as pd
+from scipy.signal import argrelextrema
+
+from pipeline import PSXDataPipeline
+from providers import SyntheticProvider
+from evaluator import classify_regime
+from scanner import StructuralScanner, WalkForwardZones, ZoneTracker, fractal_highs
+from indicators import IndicatorState
+from backtest import MIN_LIQUIDITY, _scan_loop, backtest_symbol
+
+CHECKS = ["engines", "fractals", "zones", "tracker", "indicators"]
+
+def _synthetic_universe(symbols, years, storage_path):
+    """Synthetic {symbol: dataframe} universe plus the regime series of its index."""
+    pipeline = PSXDataPipeline(storage_path, provider=SyntheticProvider(symbols=symbols, years=years),
+                               history_period=f"{years}y")
+    with contextlib.redirect_stdout(io.StringIO()):
+        frames = pipeline.update_universe()
+        df_index = pipeline.get_market_regime()
+    return frames, classify_regime(df_index) if df_index is not None else None
+
+def check_engines(frames, regimes):
+    """
+    The vectorized replay (scan_history) and the loop engine (one scanner per simulated
+    day) must give exactly the signals and zones of the reference engine, the original
+    pandas scanner run on a copy of every daily slice, over each symbol's whole history.
+    The (slow) reference runs with the production 'legacy' clustering; in 'sorted' mode
+    the fast engines are checked against each other. Their result rows (production
+    gate, outcomes) must match too.
+    Returns: (list of mismatches, what was compared)
+    """
+    mismatches, signals, replays = [], 0, 0
+    for clustering in ("legacy", "sorted"):
+        for symbol, df in frames.items():
+            scanner = StructuralScanner(df, min_liquidity_pkr=MIN_LIQUIDITY, zone_clustering=clustering,
+                                        annotate=False)
+            engines = {
+                'loop': _scan_loop(df, 200, len(df), True, clustering),
+                'vectorized': scanner.scan_history(200, len(df), with_zones=True)
+            }
+            if clustering == "legacy":
+                reference = _scan_loop(df, 200, len(df), True, clustering, annotate=True)
+            else:
+                reference = engines['loop']
+            signals += len(reference[0])
+            replays += 1
+            for engine, result in engines.items():
+                if result != reference:
+                    mismatches.append(f"{symbol} ({clustering}): {engine} found {len(result[0])} signal days, "
+                                      f"the reference {len(reference[0])}")
+
+            rows = [pd.DataFrame(backtest_symbol(symbol, df, engine, gate="production", regimes=regimes,
+                                                 clustering=clustering))
+                    for engine in engines]
+            if not rows[0].equals(rows[1]):
+                mismatches.append(f"{symbol} ({clustering}): result rows differ between loop and vectorized")
+    return mismatches, f"{signals} signal days over {replays} replays"
+
+def check_fractals(frames, cases=3000, seed=0):
+    """
+    fractal_highs must return exactly the peaks of the original
+    argrelextrema(high, np.greater_equal, order=5) call (clip mode), on every symbol's
+    highs and on random series with ties, NaNs and lengths around the window size.
+    Returns: (list of mismatches, what was compared)
+    """
+    rng = np.random.default_rng(seed)
+    series = [(symbol, df['high'].values) for symbol, df in frames.items()]
+    for case in range(cases):
+        values = np.round(rng.normal(100, 2, rng.integers(0, 40)), 0) # Rounded: plenty of ties
+        if len(values) and case % 3 == 0:
+            values[rng.integers(len(values))] = np.nan
+        series.append((f"random #{case}", values))
+
+    mismatches = []
+    for name, values in series:
+        expected = argrelextrema(values, np.greater_equal, order=5)[0]
+        if not np.array_equal(fractal_highs(values, order=5), expected):
+            mismatches.append(f"{name} ({len(values)} bars)")
+    return mismatches, f"{len(series)} series"
+
+def check_zones(frames):
+    """
+    WalkForwardZones.zones(end) must equal _find_structural_zones(end=end), the zones
+    the live scan builds, for every window end of every symbol and both clusterings.
+    Returns: (list of mismatches, what was compared)
+    """
+    mismatches, windows = [], 0
+    for clustering in ("legacy", "sorted"):
+        for symbol, df in frames.items():
+            scanner = StructuralScanner(df, zone_clustering=clustering, annotate=False)
+            walk = WalkForwardZones(scanner.columns['high'], clustering=clustering)
+            for end in range(1, len(scanner) + 1):
+                windows += 1
+                if walk.zones(end) != scanner._find_structural_zones(end=end):
+                    mismatches.append(f"{symbol} ({clustering}): window ending at bar {end}")
+    return mismatches, f"{windows} windows"
+
+def check_tracker(frames):
+    """
+    ZoneTracker, fed one bar at a time, must give _find_structural_zones(end=end)
+    after every bar of every symbol, for both clusterings.
+    Returns: (list of mismatches, what was compared)
+    """
+    mismatches, updates = [], 0
+    for clustering in ("legacy", "sorted"):
+        for symbol, df in frames.items():
+            scanner = StructuralScanner(df, zone_clustering=clustering, annotate=False)
+            tracker = ZoneTracker(clustering=clustering)
+            for end, high in enumerate(scanner.columns['high'], start=1):
+                tracker.update(high)
+                updates += 1
+                if tracker.zones() != scanner._find_structural_zones(end=end):
+                    mismatches.append(f"{symbol} ({clustering}): zones differ after bar {end - 1}")
+    return mismatches, f"{updates} updates"
+
+def check_indicators(frames):
+    """
+    IndicatorState, advanced one bar at a time as the daily scan does, must lead
+    _match_zones to the same candidates as the full compute_metrics recompute, for
+    every bar of every symbol (against that bar's zones). The raw indicator values
+    of both paths must be identical too.
+    Returns: (list of mismatches, what was compared)
+    """
+    mismatches, bars, candidates = [], 0, 0
+    for symbol, df in frames.items():
+        scanner = StructuralScanner(df, annotate=False)
+        scanner._calculate_metrics()
+        walk = WalkForwardZones(scanner.columns['high'])
+        state = IndicatorState()
+        previous = {}
+        for i, (date, high, low, close, volume) in enumerate(zip(
+                df.index, df['high'].values, df['low'].values, df['close'].values, df['volume'].values)):
+            latest = state.update(date, float(high), float(low), float(close), float(volume))
+            full = {name: float(scanner.metrics[name][i]) for name in latest}
+            if not all(latest[name] == full[name] or (np.isnan(latest[name]) and np.isnan(full[name]))
+                       for name in latest):
+                mismatches.append(f"{symbol}: indicator values differ at bar {i}")
+            if i >= 1:
+                bars += 1
+                zones = walk.zones(i + 1)
+                expected = scanner._match_zones(zones, scanner._bar(i), scanner._bar(i - 1))
+                got = scanner._match_zones(zones, dict(scanner._bar(i), **latest), dict(scanner._bar(i - 1), **previous))
+                candidates += len(expected)
+                if got != expected:
+                    mismatches.append(f"{symbol}: candidates differ at bar {i}")
+            previous = latest
+    return mismatches, f"{candidates} candidates over {bars} bars"
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Check that the fast scanner/backtest paths match their reference implementations.")
+    parser.add_argument("--checks", nargs="+", choices=CHECKS, default=CHECKS)
+    parser.add_argument("--symbols", type=int, default=24, help="Synthetic universe size")
+    parser.add_argument("--years", type=int, default=5, help="Synthetic history, in years")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        frames, regimes = _synthetic_universe(args.symbols, args.years, workdir)
+
+    failed = False
+    for check in args.checks:
+        if check == "engines":
+            mismatches, compared = check_engines(frames, regimes)
+        elif check == "fractals":
+            mismatches, compared = check_fractals(frames)
+        elif check == "zones":
+            mismatches, compared = check_zones(frames)
+        elif check == "tracker":
+            mismatches, compared = check_tracker(frames)
+        elif check == "indicators":
+            mismatches, compared = check_indicators(frames)
+        for mismatch in mismatches:
+            print(f"❌ {check}: {mismatch}")
+        if mismatches:
+            failed = True
+        else:
+            print(f"✅ {check}: identical ({compared})")
+    if failed:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
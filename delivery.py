@@ -0,0 +1,127 @@
+import asyncio
+import time
+
+class TokenBucket:
+    """
+    Async token bucket: refills `rate` tokens per second up to `capacity`.
+    acquire() waits just long enough for the next token instead of a fixed sleep.
+    """
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        # The lock keeps waiters in FIFO order
+        async with self._lock:
+            self._refill()
+            while self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= 1
+
+class AlertDispatcher:
+    """
+    Asyncio delivery stage decoupled from scanning.
+
+    The scan loop submits (symbol, candidate, prompt) items; `llm_concurrency`
+    narrator tasks call the LLM concurrently (the blocking clients run in threads)
+    and hand finished messages to a single sender task that paces Telegram with a
+    token bucket, so waiting for a send slot never holds up an LLM call.
+    With `narrate_batch`, items are grouped `batch_size` at a time and each group
+    is narrated by one call that returns one message per item.
+    `on_sent(symbol, candidate)` runs on the event loop after each delivery, so
+    the alert history is only ever written from one thread.
+    With `metrics`, LLM and Telegram call times go to the 'narrate' and 'deliver'
+    stages and the llm_seconds / telegram_seconds histograms.
+    """
+    def __init__(self, narrate, send, on_sent=None, llm_concurrency=4,
+                 telegram_rate=1.0, telegram_burst=3, metrics=None,
+                 narrate_batch=None, batch_size=1):
+        self.narrate = narrate
+        self.narrate_batch = narrate_batch
+        self.batch_size = batch_size if narrate_batch else 1
+        self.send = send
+        self.on_sent = on_sent
+        self.llm_concurrency = llm_concurrency
+        self.bucket = TokenBucket(telegram_rate, telegram_burst)
+        self.metrics = metrics
+        self.sent = 0
+        self._pending = []
+        self._prompts = asyncio.Queue()
+        self._messages = asyncio.Queue()
+        self._narrators = []
+        self._sender = None
+
+    def start(self):
+        self._narrators = [asyncio.create_task(self._narrator()) for _ in range(self.llm_concurrency)]
+        self._sender = asyncio.create_task(self._send_loop())
+
+    def submit(self, symbol, candidate, prompt):
+        self._pending.append((symbol, candidate, prompt))
+        if len(self._pending) >= self.batch_size:
+            self._flush()
+
+    def _flush(self):
+        if self._pending:
+            self._prompts.put_nowait(self._pending)
+            self._pending = []
+
+    async def close(self):
+        """Waits for every submitted alert to be delivered, then stops the tasks."""
+        self._flush()
+        for _ in self._narrators:
+            self._prompts.put_nowait(None)
+        await asyncio.gather(*self._narrators)
+        self._messages.put_nowait(None)
+        await self._sender
+
+    async def _timed(self, stage, name, fn, *args):
+        """Runs `fn` in a thread, adding its time to the `stage` timer and the `name` histogram."""
+        start = time.perf_counter()
+        try:
+            return await asyncio.to_thread(fn, *args)
+        finally:
+            if self.metrics:
+                elapsed = time.perf_counter() - start
+                self.metrics.observe(name, elapsed)
+                self.metrics.add_stage(stage, elapsed)
+
+    async def _narrator(self):
+        while True:
+            batch = await self._prompts.get()
+            if batch is None:
+                return
+            try:
+                if self.narrate_batch:
+                    messages = await self._timed("narrate", "llm_seconds", self.narrate_batch, batch)
+                else:
+                    messages = [await self._timed("narrate", "llm_seconds", self.narrate, batch[0][2])]
+            except Exception as e:
+                print(f"❌ Narration failed for {', '.join(item[0] for item in batch)}: {e}")
+                continue
+            for (symbol, candidate, _), message in zip(batch, messages):
+                self._messages.put_nowait((symbol, candidate, message))
+
+    async def _send_loop(self):
+        while True:
+            item = await self._messages.get()
+            if item is None:
+                return
+            symbol, candidate, message = item
+            await self.bucket.acquire()
+            try:
+                await self._timed("deliver", "telegram_seconds", self.send, message)
+            except Exception as e:
+                print(f"❌ Delivery failed for {symbol}: {e}")
+                continue
+            self.sent += 1
+            if self.on_sent:
+                self.on_sent(symbol, candidate)
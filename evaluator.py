@@ -1,51 +1,133 @@
 import pandas as pd
 import numpy as np
 
+NARRATIVE_BRIEF = """
+        ACT AS: Senior Proprietary Trader for PSX.
+        TASK: Summarize this technical breakout for the internal desk.
+        STYLE: Clinical, Data-Driven, No Hype.
+"""
+
+NARRATIVE_TEMPLATE = """
+        OUTPUT TEMPLATE:
+        🚨 **STRUCTURE BREAK: {Ticker}**
+        
+        **The Setup**
+        [1 sentence on the compression/coil context]
+
+        **The Trigger**
+        [1 sentence on the volume and extension strength]
+
+        **Context**
+        [Comment on resistance clearance and market regime]
+
+        *Quality Score: [0-10 based on metrics]*
+        """
+
+NEUTRAL_REGIME = {'status': 'NEUTRAL', 'vol_mult': 1.0}
+
+def classify_regime(df_index):
+    """
+    Market regime for every date of the KSE-100 history, in one vectorized pass.
+    Each row only uses bars up to its date, so row d is what the live scan
+    concludes on day d. Returns: DataFrame (close, sma_200, rsi, status, vol_mult).
+    """
+    close = df_index['close']
+
+    # Calculate Index Technicals
+    sma_200 = close.rolling(200).mean()
+    
+    # Simple RSI
+    delta = close.diff()
+    gain = (delta.where(delta > 0, 0)).rolling(14).mean()
+    loss = (-delta.where(delta < 0, 0)).rolling(14).mean()
+    rs = gain / loss
+    rsi = 100 - (100 / (1 + rs))
+
+    # Not enough history yet: fall back to the close (no trend) and a neutral RSI
+    current_sma = sma_200.fillna(close)
+    current_rsi = rsi.fillna(50)
+
+    # --- Regime Logic ---
+    # Bear Market: Below 200 SMA + Low Momentum
+    risk_off = (close < current_sma) & (current_rsi < 45)
+    # Overheated: Way above SMA + High RSI
+    overextended = ~risk_off & (close > current_sma * 1.15) & (current_rsi > 75)
+
+    return pd.DataFrame({
+        'close': close,
+        'sma_200': sma_200,
+        'rsi': rsi,
+        'status': np.select([risk_off, overextended], ['RISK_OFF', 'OVEREXTENDED'], 'RISK_ON'),
+        # Require 40% MORE volume to trust a breakout in a bear market, 20% when overheated
+        'vol_mult': np.select([risk_off, overextended], [1.4, 1.2], 1.0)
+    }, index=df_index.index)
+
+def regimes_on(regimes, dates):
+    """
+    Regime as of each of `dates` (the last index bar on or before it), from a
+    classify_regime() frame. Dates before the index history (or without one) are NEUTRAL.
+    Returns: (status array, vol_mult array)
+    """
+    dates = pd.DatetimeIndex(np.atleast_1d(dates))
+    status = np.full(len(dates), NEUTRAL_REGIME['status'], dtype=object)
+    vol_mult = np.full(len(dates), NEUTRAL_REGIME['vol_mult'])
+    if regimes is None or regimes.empty:
+        return status, vol_mult
+    rows = regimes.index.searchsorted(dates, side='right') - 1
+    known = rows >= 0
+    status[known] = regimes['status'].to_numpy()[rows[known]]
+    vol_mult[known] = regimes['vol_mult'].to_numpy()[rows[known]]
+    return status, vol_mult
+
+def gate_signals(levels, vol_expansion, zone_levels, status, vol_mult):
+    """
+    Batch version of AgenticEvaluator.evaluate_signal's filters (without the narrative).
+    One entry per candidate: breakout level, volume expansion, the regime of its date
+    and its structural zones as a row of `zone_levels` (sorted, NaN-padded).
+    Returns: (accepted mask, next resistance level (NaN = Blue Sky), upside %)
+    """
+    levels = np.asarray(levels, dtype=float)
+    zone_levels = np.asarray(zone_levels, dtype=float)
+
+    # 1. Regime Filter
+    accepted = ~(np.asarray(vol_expansion) < 1.8 * np.asarray(vol_mult))
+
+    # 2. Location Context: next resistance at least 3% above the breakout
+    # (zones are sorted, so the first one above is the lowest; NaN padding never qualifies)
+    above = zone_levels > (levels * 1.03)[:, None]
+    next_resistance = np.where(above, zone_levels, np.inf).min(axis=1, initial=np.inf)
+    next_resistance[np.isinf(next_resistance)] = np.nan
+    upside = ((next_resistance - levels) / levels) * 100
+
+    # 3. Location Filter: reject low R:R trades in bad markets (Blue Sky is never rejected)
+    accepted &= ~((upside < 5.0) & (np.asarray(status) != 'RISK_ON'))
+    return accepted, next_resistance, upside
+
 class AgenticEvaluator:
     def __init__(self, pipeline_instance):
         self.pipeline = pipeline_instance
+        self.regimes = None
         self.market_regime = self._assess_market_regime()
 
     def _assess_market_regime(self):
         """
         Determines global market health (Risk-On / Risk-Off).
+        Classifies the stored KSE-100 history once (self.regimes, one row per date)
+        and returns the latest regime.
         """
         df_index = self.pipeline.get_market_regime()
         
         # Default safe state if data fails
         if df_index is None or df_index.empty:
-            return {'status': 'NEUTRAL', 'vol_mult': 1.0}
+            return dict(NEUTRAL_REGIME)
 
-        # Calculate Index Technicals
-        df_index['sma_200'] = df_index['close'].rolling(200).mean()
-        
-        # Simple RSI
-        delta = df_index['close'].diff()
-        gain = (delta.where(delta > 0, 0)).rolling(14).mean()
-        loss = (-delta.where(delta < 0, 0)).rolling(14).mean()
-        rs = gain / loss
-        df_index['rsi'] = 100 - (100 / (1 + rs))
-
-        current_close = df_index['close'].iloc[-1]
-        current_sma = df_index['sma_200'].iloc[-1] if not np.isnan(df_index['sma_200'].iloc[-1]) else current_close
-        current_rsi = df_index['rsi'].iloc[-1] if not np.isnan(df_index['rsi'].iloc[-1]) else 50
-
-        # --- Regime Logic ---
-        # Bear Market: Below 200 SMA + Low Momentum
-        if current_close < current_sma and current_rsi < 45:
-            return {
-                'status': 'RISK_OFF', 
-                'vol_mult': 1.4  # Require 40% MORE volume to trust breakout
-            }
-        
-        # Overheated: Way above SMA + High RSI
-        elif current_close > (current_sma * 1.15) and current_rsi > 75:
-            return {
-                'status': 'OVEREXTENDED', 
-                'vol_mult': 1.2  # Caution required
-            }
+        self.regimes = classify_regime(df_index)
+        return self.regime_on(self.regimes.index[-1])
 
-        return {'status': 'RISK_ON', 'vol_mult': 1.0}
+    def regime_on(self, date):
+        """Regime as of `date` (the last index bar on or before it), for historical replays."""
+        status, vol_mult = regimes_on(self.regimes, [date])
+        return {'status': status[0], 'vol_mult': float(vol_mult[0])}
 
     def evaluate_signal(self, ticker, signal_data, structural_zones):
         """
@@ -88,11 +170,11 @@ class AgenticEvaluator:
         """
         Constructs the Prompt for the LLM.
         """
-        return f"""
-        ACT AS: Senior Proprietary Trader for PSX.
-        TASK: Summarize this technical breakout for the internal desk.
-        STYLE: Clinical, Data-Driven, No Hype.
+        return NARRATIVE_BRIEF + self._narrative_data(ticker, data) + NARRATIVE_TEMPLATE
 
+    def _narrative_data(self, ticker, data):
+        """DATA block of the narrative prompt for one signal."""
+        return f"""
         DATA:
         - Ticker: {ticker}
         - Setup: Breakout from Volatility Compression
@@ -102,18 +184,21 @@ class AgenticEvaluator:
         - Compression Score: {data['compression_score']} (Higher is tighter coil)
         - Overhead Supply: {data['next_resistance']}
         - Market Environment: {self.market_regime['status']}
+"""
 
-        OUTPUT TEMPLATE:
-        🚨 **STRUCTURE BREAK: {{Ticker}}**
-        
-        **The Setup**
-        [1 sentence on the compression/coil context]
-
-        **The Trigger**
-        [1 sentence on the volume and extension strength]
-
-        **Context**
-        [Comment on resistance clearance and market regime]
-
-        *Quality Score: [0-10 based on metrics]*
-        """
\ No newline at end of file
+    def batch_narrative(self, signals):
+        """
+        One prompt covering several accepted signals: the brief and output template
+        appear once, followed by a DATA block per signal tagged with its id.
+        Args:
+            signals: List of (signal_id, ticker, signal_data) after evaluate_signal.
+        """
+        blocks = "".join(
+            f"\n        ### SIGNAL {signal_id}" + self._narrative_data(ticker, data)
+            for signal_id, ticker, data in signals
+        )
+        return NARRATIVE_BRIEF + NARRATIVE_TEMPLATE + f"""
+        Write one message per signal below, each following the OUTPUT TEMPLATE.
+        Reply with ONLY a JSON object mapping each SIGNAL id to its message,
+        e.g. {{"SYS#1": "..."}}.
+""" + blocks
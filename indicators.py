@@ -0,0 +1,149 @@
+import json
+import math
+import os
+import pandas as pd
+import numpy as np
+
+class RollingMean:
+    """
+    Fixed-window mean over a ring buffer: a fixed amount of work per value.
+    Like pandas' rolling(window).mean(), the mean is NaN until the window is full
+    and while any NaN is inside it. The window is summed oldest first, the same
+    additions in the same order as compute_metrics' sum of shifted slices, so the
+    live scan's indicators are bit-identical to a full recompute (a running sum
+    drifts from it by a few ulps).
+    """
+    def __init__(self, window):
+        self.window = window
+        self.buffer = [math.nan] * window
+        self.pos = 0
+        self.count = 0
+        self.nans = window
+
+    def push(self, value):
+        self.nans += math.isnan(value) - math.isnan(self.buffer[self.pos])
+        self.buffer[self.pos] = value
+        self.pos = (self.pos + 1) % self.window
+        self.count += 1
+        return self.mean()
+
+    def mean(self):
+        if self.count < self.window or self.nans:
+            return math.nan
+        # Oldest value first (the ring's next write position)
+        total = self.buffer[self.pos]
+        for k in range(1, self.window):
+            total += self.buffer[(self.pos + k) % self.window]
+        return total / self.window
+
+    def to_dict(self):
+        return {'window': self.window, 'buffer': self.buffer, 'pos': self.pos, 'count': self.count}
+
+    @classmethod
+    def from_dict(cls, data):
+        rolling = cls(data['window'])
+        rolling.buffer = [float(v) for v in data['buffer']]
+        rolling.pos = data['pos']
+        rolling.count = data['count']
+        rolling.nans = sum(math.isnan(v) for v in rolling.buffer)
+        return rolling
+
+class IndicatorState:
+    """
+    Incremental version of StructuralScanner._calculate_metrics.
+
+    Holds the previous close and ring buffers for the 5/14/20-bar ATRs and the
+    20-bar volume SMA, so each new bar costs O(1). `latest` and `previous` hold
+    the metrics of the last two bars, which is all evaluate_breakout needs.
+    The state is JSON-serialisable and is stored next to the OHLCV data.
+    """
+    def __init__(self):
+        self.last_date = None
+        self.prev_close = math.nan
+        self.bars = 0
+        self.windows = {
+            'atr_5': RollingMean(5),
+            'atr_14': RollingMean(14),
+            'atr_20': RollingMean(20),
+            'vol_sma_20': RollingMean(20)
+        }
+        self.latest = {}
+        self.previous = {}
+
+    def update(self, date, high, low, close, volume):
+        """Consumes one bar. Returns its metrics (tr, atr_*, compression_ratio, vol_sma_20)."""
+        # True Range (NaN on the first bar, as with close.shift(1))
+        tr = max(high - low, abs(high - self.prev_close), abs(low - self.prev_close))
+        if math.isnan(self.prev_close):
+            tr = math.nan
+
+        metrics = {'tr': tr}
+        for name in ('atr_5', 'atr_14', 'atr_20'):
+            metrics[name] = self.windows[name].push(tr)
+        metrics['compression_ratio'] = (
+            metrics['atr_5'] / metrics['atr_20'] if metrics['atr_20'] else math.nan
+        )
+        metrics['vol_sma_20'] = self.windows['vol_sma_20'].push(float(volume))
+
+        self.previous, self.latest = self.latest, metrics
+        self.prev_close = float(close)
+        self.last_date = pd.Timestamp(date)
+        self.bars += 1
+        return metrics
+
+    def advance(self, df):
+        """
+        Feeds the bars of `df` newer than `last_date`.
+        Returns False (nothing consumed) if the frame no longer matches the state:
+        the last seen bar is missing or its close was revised (e.g. adjusted prices).
+        """
+        if self.last_date is not None:
+            if self.last_date not in df.index or not np.isclose(df.at[self.last_date, 'close'], self.prev_close):
+                return False
+            df = df[df.index > self.last_date]
+        for date, high, low, close, volume in zip(
+                df.index, df['high'].values, df['low'].values, df['close'].values, df['volume'].values):
+            self.update(date, float(high), float(low), float(close), float(volume))
+        return True
+
+    @classmethod
+    def from_frame(cls, df):
+        state = cls()
+        state.advance(df)
+        return state
+
+    def to_dict(self):
+        return {
+            'last_date': None if self.last_date is None else self.last_date.isoformat(),
+            'prev_close': self.prev_close,
+            'bars': self.bars,
+            'windows': {name: w.to_dict() for name, w in self.windows.items()},
+            'latest': self.latest,
+            'previous': self.previous
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        state = cls()
+        state.last_date = None if data['last_date'] is None else pd.Timestamp(data['last_date'])
+        state.prev_close = float(data['prev_close'])
+        state.bars = data['bars']
+        state.windows = {name: RollingMean.from_dict(w) for name, w in data['windows'].items()}
+        state.latest = data['latest']
+        state.previous = data['previous']
+        return state
+
+    def save(self, path):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.to_dict(), f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """Returns the stored state, or None if it is missing or unreadable."""
+        try:
+            with open(path) as f:
+                return cls.from_dict(json.load(f))
+        except (OSError, ValueError, KeyError):
+            return None
@@ -0,0 +1,129 @@
+import json
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+import numpy as np
+
+# Latency histogram bucket upper bounds (seconds), Prometheus-style
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class RunMetrics:
+    """
+    Wall-clock timers and latency histograms for one scan run.
+
+    Stages accumulate (a stage entered once per alert sums over the run, and
+    concurrent calls sum their busy time); observations keep every sample so
+    quantiles are exact.
+    Export as JSON lines (one record per stage/histogram) or Prometheus text.
+    """
+    def __init__(self, prefix="psx_scan"):
+        self.prefix = prefix
+        self.started_at = datetime.now().isoformat()
+        self.stages = {}
+        self.samples = {}
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_stage(name, time.perf_counter() - start)
+
+    def add_stage(self, name, seconds):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    @contextmanager
+    def timed(self, name):
+        """Times one sample of a latency histogram (e.g. a single symbol's scan)."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def observe(self, name, seconds):
+        self.samples.setdefault(name, []).append(seconds)
+
+    def _histogram(self, name):
+        values = np.asarray(self.samples[name])
+        counts = [int((values <= bound).sum()) for bound in LATENCY_BUCKETS]
+        return {
+            'count': len(values),
+            'sum': float(values.sum()),
+            'p50': float(np.percentile(values, 50)),
+            'p95': float(np.percentile(values, 95)),
+            'p99': float(np.percentile(values, 99)),
+            'max': float(values.max()),
+            'buckets': dict(zip([str(b) for b in LATENCY_BUCKETS] + ['+Inf'], counts + [len(values)]))
+        }
+
+    def to_json_lines(self):
+        records = [
+            {'type': 'stage', 'run': self.started_at, 'stage': name, 'seconds': round(seconds, 6)}
+            for name, seconds in self.stages.items()
+        ]
+        records += [
+            dict({'type': 'histogram', 'run': self.started_at, 'name': name}, **self._histogram(name))
+            for name in self.samples
+        ]
+        return "\n".join(json.dumps(r) for r in records) + "\n"
+
+    def to_prometheus(self):
+        lines = [
+            f"# HELP {self.prefix}_stage_seconds Wall-clock time spent per pipeline stage.",
+            f"# TYPE {self.prefix}_stage_seconds gauge"
+        ]
+        lines += [f'{self.prefix}_stage_seconds{{stage="{name}"}} {seconds:.6f}'
+                  for name, seconds in self.stages.items()]
+        for name in self.samples:
+            hist = self._histogram(name)
+            metric = f"{self.prefix}_{name}"
+            lines += [f"# TYPE {metric} histogram"]
+            lines += [f'{metric}_bucket{{le="{le}"}} {count}' for le, count in hist['buckets'].items()]
+            lines += [f"{metric}_sum {hist['sum']:.6f}", f"{metric}_count {hist['count']}"]
+        return "\n".join(lines) + "\n"
+
+    def write(self, path, fmt="jsonl"):
+        """Writes the metrics to `path` ('-' for stdout) as 'jsonl' or 'prometheus'."""
+        text = self.to_prometheus() if fmt == "prometheus" else self.to_json_lines()
+        if path == "-":
+            print(text, end="")
+        else:
+            with open(path, 'w') as f:
+                f.write(text)
+
+@contextmanager
+def profiled(path, profiler="cprofile"):
+    """
+    Profiles the enclosed block and dumps the result to `path`.
+    cProfile writes pstats data (open with snakeviz/pstats) and prints the top
+    functions; pyinstrument (optional dependency) writes an HTML call tree.
+    """
+    if profiler == "pyinstrument":
+        from pyinstrument import Profiler
+
+        prof = Profiler()
+        prof.start()
+        try:
+            yield
+        finally:
+            prof.stop()
+            with open(path, 'w') as f:
+                f.write(prof.output_html())
+            print(f"🧭 Profile saved to {path}")
+        return
+
+    import cProfile
+    import pstats
+
+    prof = cProfile.Profile()
+    prof.enable()
+    try:
+        yield
+    finally:
+        prof.disable()
+        prof.dump_stats(path)
+        pstats.Stats(prof).sort_stats("cumulative").print_stats(25)
+        print(f"🧭 Profile saved to {path}")
@@ -0,0 +1,197 @@
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from pathlib import Path
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from transport import HttpTransport
+
+OPENAI_API_BASE = "https://api.openai.com/v1"
+SYSTEM_PROMPT = "You are a succinct financial risk analyst. Output in Markdown."
+
+class NarrativeCache:
+    """
+    Content-addressed on-disk cache of completions.
+
+    Entries are keyed by a SHA-256 of the normalized prompt (whitespace-insensitive)
+    plus endpoint, model, temperature and max_tokens, so reruns and retries of the
+    same signal hit the cache while replies from a stub or another compatible server
+    never answer calls to the real one. Entries older than `ttl_seconds` are ignored, and once
+    the directory grows past `max_bytes` the least recently used entries
+    (by file mtime, refreshed on every hit) are evicted.
+    """
+    def __init__(self, path=".narrative_cache", ttl_seconds=48 * 3600, max_bytes=5_000_000):
+        self.path = Path(path)
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.path.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def key(base_url, model, temperature, max_tokens, system, prompt):
+        normalize = lambda text: "\n".join(" ".join(line.split()) for line in text.splitlines() if line.strip())
+        payload = json.dumps([base_url, model, temperature, max_tokens, normalize(system), normalize(prompt)])
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def get(self, key):
+        entry_path = self.path / f"{key}.json"
+        try:
+            with open(entry_path) as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if time.time() - entry.get("created", 0) > self.ttl_seconds:
+            entry_path.unlink(missing_ok=True)
+            return None
+        os.utime(entry_path) # Mark as recently used
+        return entry.get("text")
+
+    def put(self, key, text):
+        # Temp file + rename so concurrent readers never see a partial entry
+        fd, tmp_path = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump({"created": time.time(), "text": text}, f)
+        os.replace(tmp_path, self.path / f"{key}.json")
+        self._evict()
+
+    def _evict(self):
+        entries = []
+        for entry_path in self.path.glob("*.json"):
+            try:
+                stat = entry_path.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry_path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry_path in sorted(entries, key=lambda e: e[0]):
+            if total <= self.max_bytes:
+                break
+            entry_path.unlink(missing_ok=True)
+            total -= size
+
+class ChatClient:
+    """
+    Minimal OpenAI chat-completions client on the shared HttpTransport
+    (pooled connections, 429/5xx retries honouring the rate-limit headers).
+    `base_url` can point at any compatible endpoint, e.g. a local stub server.
+    With a NarrativeCache, identical requests are answered from disk.
+    """
+    def __init__(self, api_key, transport=None, base_url=OPENAI_API_BASE, model="gpt-4", cache=None):
+        self.api_key = api_key
+        self.transport = transport or HttpTransport()
+        self.base_url = base_url.rstrip("/")
+        self.model = model
+        self.cache = cache
+
+    def complete(self, prompt, system=SYSTEM_PROMPT, temperature=0.3, max_tokens=250):
+        """Returns the completion text. Raises requests.HTTPError on a failed request."""
+        if self.cache:
+            key = self.cache.key(self.base_url, self.model, temperature, max_tokens, system, prompt)
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+
+        resp = self.transport.post_json(
+            f"{self.base_url}/chat/completions",
+            {
+                "model": self.model,
+                "messages": [
+                    {"role": "system", "content": system},
+                    {"role": "user", "content": prompt}
+                ],
+                "temperature": temperature,
+                "max_tokens": max_tokens
+            },
+            headers={"Authorization": f"Bearer {self.api_key}"}
+        )
+        resp.raise_for_status()
+        text = resp.json()["choices"][0]["message"]["content"]
+        if self.cache:
+            self.cache.put(key, text)
+        return text
+
+def parse_batch_reply(text, signal_ids):
+    """
+    Splits a batched completion back into {signal_id: message}.
+    Tolerates Markdown code fences around the JSON; ids the model skipped are
+    simply absent so the caller can narrate them individually.
+    """
+    match = re.search(r"\{.*\}", text, re.DOTALL)
+    if not match:
+        return {}
+    try:
+        reply = json.loads(match.group(0))
+    except json.JSONDecodeError:
+        return {}
+    if not isinstance(reply, dict):
+        return {}
+    return {sid: str(reply[sid]) for sid in signal_ids if reply.get(sid)}
+
+def chunk_by_size(items, max_items, max_chars, size=len):
+    """Greedy split of `items` into runs of at most `max_items` and `max_chars` (by `size`)."""
+    chunks, current, chars = [], [], 0
+    for item in items:
+        if current and (len(current) >= max_items or chars + size(item) > max_chars):
+            chunks.append(current)
+            current, chars = [], 0
+        current.append(item)
+        chars += size(item)
+    if current:
+        chunks.append(current)
+    return chunks
+
+class StubCompletionServer:
+    """
+    Local stand-in for the chat-completions endpoint, for offline runs and tests.
+
+    Answers POST {base_url}/chat/completions deterministically: batched prompts
+    (with '### SIGNAL <id>' blocks) get a JSON object with one canned message per
+    id, single prompts get one canned message. Every request body is recorded
+    in `requests`.
+    """
+    def __init__(self, host="127.0.0.1", port=0):
+        self.requests = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                stub.requests.append(body)
+                reply = json.dumps({"choices": [{"message": {"content": stub.reply(body)}}]}).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(reply)))
+                self.end_headers()
+                self.wfile.write(reply)
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.base_url = f"http://{host}:{self.server.server_port}/v1"
+
+    @staticmethod
+    def _message(block):
+        ticker = re.search(r"- Ticker: (\S+)", block)
+        return f"🚨 **STRUCTURE BREAK: {ticker.group(1) if ticker else '?'}** (stub narrative)"
+
+    def reply(self, body):
+        prompt = body["messages"][-1]["content"]
+        ids = re.findall(r"### SIGNAL (\S+)", prompt)
+        if not ids:
+            return self._message(prompt)
+        blocks = re.split(r"### SIGNAL \S+", prompt)[1:]
+        return json.dumps({sid: self._message(block) for sid, block in zip(ids, blocks)})
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
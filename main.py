@@ -1,15 +1,20 @@
 import os
-import json
-import requests
-import time
-from datetime import datetime
-from pathlib import Path
+import argparse
+import asyncio
+import functools
 from dotenv import load_dotenv
 
 # Import modules
 from pipeline import PSXDataPipeline
-from scanner import StructuralScanner
+from scanner import StructuralScanner, prefilter_universe
+from panel import UniversePanel, LATEST_DEPTH
+from alerts import AlertManager, TradingCalendar
 from evaluator import AgenticEvaluator
+from providers import make_provider
+from instrumentation import RunMetrics, profiled
+from delivery import AlertDispatcher
+from transport import HttpTransport
+from llm import ChatClient, NarrativeCache, OPENAI_API_BASE, StubCompletionServer, chunk_by_size, parse_batch_reply
 
 # Load environment variables (for local dev)
 # On GitHub Actions, these are injected automatically from Secrets
@@ -19,12 +24,42 @@ load_dotenv()
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 TELEGRAM_CHAT_ID = os.getenv("TELEGRAM_CHAT_ID")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+# Endpoints can be pointed at local stub servers for testing
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", OPENAI_API_BASE)
+TELEGRAM_API_BASE = os.getenv("TELEGRAM_API_BASE", "https://api.telegram.org")
 HISTORY_FILE = "alert_history.json"
+# Trading sessions a symbol stays muted after an alert
+COOLDOWN_SESSIONS = int(os.getenv("PSX_COOLDOWN_SESSIONS", "5"))
+# Append only the missing bars to the local store instead of re-downloading 2y
+INCREMENTAL_SYNC = os.getenv("PSX_INCREMENTAL_SYNC", "false").lower() == "true"
+# Data source: 'yahoo' (live), 'local' (fixture files in PSX_DATA_PATH) or 'synthetic'
+DATA_PROVIDER = os.getenv("PSX_DATA_PROVIDER", "yahoo")
+DATA_PATH = os.getenv("PSX_DATA_PATH", "./fixtures")
+SYNTHETIC_SYMBOLS = int(os.getenv("PSX_SYNTHETIC_SYMBOLS", "30"))
+# Zone clustering: 'legacy' (first-match, the production rule) or 'sorted' (order-independent)
+ZONE_CLUSTERING = os.getenv("PSX_ZONE_CLUSTERING", "legacy")
+# Pre-filter with the full indicator checks, computed for the whole universe as one panel
+PANEL_SCAN = os.getenv("PSX_PANEL_SCAN", "false").lower() == "true"
+# Alert delivery: concurrent LLM calls and Telegram token bucket (messages/sec, burst)
+LLM_CONCURRENCY = int(os.getenv("PSX_LLM_CONCURRENCY", "4"))
+TELEGRAM_RATE = float(os.getenv("PSX_TELEGRAM_RATE", "1.0"))
+TELEGRAM_BURST = int(os.getenv("PSX_TELEGRAM_BURST", "3"))
+# Batched narration: signals per completion request (1 = one request per signal) and prompt size cap
+LLM_BATCH_SIZE = int(os.getenv("PSX_LLM_BATCH_SIZE", "1"))
+LLM_BATCH_CHARS = int(os.getenv("PSX_LLM_BATCH_CHARS", "12000"))
+# On-disk narrative cache so reruns/retries don't pay for the same completion twice ('' disables)
+NARRATIVE_CACHE_DIR = os.getenv("PSX_NARRATIVE_CACHE", ".narrative_cache")
+NARRATIVE_CACHE_TTL = float(os.getenv("PSX_NARRATIVE_CACHE_TTL", str(48 * 3600)))
+
+# One pooled keep-alive session shared by Telegram and OpenAI calls
+HTTP = HttpTransport(pool_size=max(10, LLM_CONCURRENCY + 2))
 
 class TelegramSender:
-    def __init__(self, token, chat_id):
+    def __init__(self, token, chat_id, transport=None, api_base=None):
         self.token = token
         self.chat_id = chat_id
+        self.transport = transport or HTTP
+        self.api_base = api_base or TELEGRAM_API_BASE
     
     def send(self, message):
         """Sends message to Telegram. Prints to console if creds are missing."""
@@ -32,58 +67,30 @@ class TelegramSender:
             print(f"\n📢 [CONSOLE ALERT] \n{message}\n")
             return
 
-        url = f"https://api.telegram.org/bot{self.token}/sendMessage"
+        url = f"{self.api_base}/bot{self.token}/sendMessage"
         payload = {
             "chat_id": self.chat_id,
             "text": message,
             "parse_mode": "Markdown"
         }
         try:
-            resp = requests.post(url, json=payload, timeout=10)
+            resp = self.transport.post_json(url, payload)
             if resp.status_code != 200:
                 print(f"❌ Telegram Error: {resp.text}")
         except Exception as e:
             print(f"❌ Connection Error: {e}")
 
-class AlertManager:
-    def __init__(self, filepath):
-        self.filepath = Path(filepath)
-        self.history = self._load_history()
-
-    def _load_history(self):
-        """Loads JSON history. Returns empty dict if file is missing/corrupt."""
-        if self.filepath.exists():
-            try:
-                with open(self.filepath, 'r') as f:
-                    return json.load(f)
-            except json.JSONDecodeError:
-                print("⚠️ History file corrupted. Starting fresh.")
-                return {}
-        return {}
-
-    def is_cooling_down(self, symbol, cooldown_days=5):
-        """Returns True if symbol was alerted recently."""
-        if symbol in self.history:
-            try:
-                last_date_str = self.history[symbol]['date']
-                last_date = datetime.fromisoformat(last_date_str)
-                days_diff = (datetime.now() - last_date).days
-                if days_diff < cooldown_days:
-                    return True
-            except (ValueError, KeyError):
-                pass # Invalid date format in file, ignore
-        return False
-
-    def log_alert(self, symbol, data):
-        """Updates the history file."""
-        self.history[symbol] = {
-            "date": datetime.now().isoformat(),
-            "level": data['level'],
-            "score": data.get('compression_score', 0)
-        }
-        # Atomic write to avoid corruption
-        with open(self.filepath, 'w') as f:
-            json.dump(self.history, f, indent=4)
+_CHAT_CLIENT = None
+
+def _chat_client():
+    """Shared chat client, created once per process instead of once per alert."""
+    global _CHAT_CLIENT
+    if _CHAT_CLIENT is None or _CHAT_CLIENT.api_key != OPENAI_API_KEY:
+        cache = NarrativeCache(NARRATIVE_CACHE_DIR, ttl_seconds=NARRATIVE_CACHE_TTL) if NARRATIVE_CACHE_DIR else None
+        _CHAT_CLIENT = ChatClient(OPENAI_API_KEY, transport=HTTP, base_url=OPENAI_BASE_URL,
+                                  model="gpt-4", # Or "gpt-3.5-turbo" for lower cost
+                                  cache=cache)
+    return _CHAT_CLIENT
 
 def generate_llm_summary(prompt):
     """
@@ -94,83 +101,98 @@ def generate_llm_summary(prompt):
         return f"⚠️ **(No AI Key)** - Raw Signal:\n{prompt}"
 
     try:
-        from openai import OpenAI
-        client = OpenAI(api_key=OPENAI_API_KEY)
-        
-        response = client.chat.completions.create(
-            model="gpt-4", # Or "gpt-3.5-turbo" for lower cost
-            messages=[
-                {"role": "system", "content": "You are a succinct financial risk analyst. Output in Markdown."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.3,
-            max_tokens=250
-        )
-        return response.choices[0].message.content
+        return _chat_client().complete(prompt, temperature=0.3, max_tokens=250)
     except Exception as e:
         print(f"❌ OpenAI Error: {e}")
         return f"⚠️ **AI Error** - Raw Signal:\n{prompt}"
 
-def main():
+def generate_llm_batch(items, evaluator):
+    """
+    Narrates several accepted signals with one completion per size-bounded chunk.
+    Args:
+        items: List of (symbol, candidate, prompt) from the scan.
+    Returns: One message per item, in order. Signals missing from the reply (or in a
+    failed request) fall back to generate_llm_summary.
+    """
+    if not OPENAI_API_KEY:
+        return [generate_llm_summary(prompt) for _, _, prompt in items]
+
+    signals = [(f"{symbol}#{n}", symbol, candidate) for n, (symbol, candidate, _) in enumerate(items, 1)]
+    chunks = chunk_by_size(signals, LLM_BATCH_SIZE, LLM_BATCH_CHARS,
+                           size=lambda s: len(evaluator._narrative_data(s[1], s[2])))
+    messages = {}
+    for chunk in chunks:
+        try:
+            reply = _chat_client().complete(evaluator.batch_narrative(chunk),
+                                            temperature=0.3, max_tokens=250 * len(chunk))
+            messages.update(parse_batch_reply(reply, [sid for sid, _, _ in chunk]))
+        except Exception as e:
+            print(f"❌ OpenAI Error: {e}")
+
+    return [messages.get(sid) or generate_llm_summary(prompt)
+            for (sid, _, _), (_, _, prompt) in zip(signals, items)]
+
+def build_provider():
+    """Data source selected by PSX_DATA_PROVIDER (offline runs need no network)."""
+    if DATA_PROVIDER == "local":
+        return make_provider("local", path=DATA_PATH)
+    if DATA_PROVIDER == "synthetic":
+        return make_provider("synthetic", symbols=SYNTHETIC_SYMBOLS)
+    return make_provider(DATA_PROVIDER)
+
+def main(pipeline=None, metrics=None):
     print("🚀 Starting PSX Regime Shift Detector...")
+    metrics = metrics or RunMetrics()
     
+    with metrics.stage("total"):
+        _run_scan(pipeline, metrics)
+    return metrics
+
+def _run_scan(pipeline, metrics):
     # 1. Init Components
-    pipeline = PSXDataPipeline()
+    pipeline = pipeline or PSXDataPipeline(provider=build_provider())
     telegram = TelegramSender(TELEGRAM_BOT_TOKEN, TELEGRAM_CHAT_ID)
     manager = AlertManager(HISTORY_FILE)
     
     # 2. Fetch Data (In-Memory)
     # This returns a Dict { 'SYS': dataframe, ... }
     # optimized for cloud so we don't read/write to disk
-    market_data = pipeline.update_universe()
+    with metrics.stage("fetch"):
+        market_data = pipeline.update_universe(incremental=INCREMENTAL_SYNC)
     
     if not market_data:
         print("❌ No data fetched. Aborting.")
         return
 
     # 3. Assess Market Regime
-    evaluator = AgenticEvaluator(pipeline)
+    with metrics.stage("regime"):
+        evaluator = AgenticEvaluator(pipeline)
     regime = evaluator.market_regime
     print(f"🌍 Market Regime: {regime['status']} (Vol Multiplier: {regime['vol_mult']}x)")
     
-    alerts_triggered = 0
+    # 4. Cooldown: one lookup for the whole universe against the alert index,
+    # counted in trading sessions of the calendar the fetched bars define
+    calendar = TradingCalendar.from_frames(market_data)
+    cooling = manager.cooling_down_mask(market_data, COOLDOWN_SESSIONS, calendar=calendar)
+    market_data = {symbol: df for (symbol, df), skip in zip(market_data.items(), cooling) if not skip}
 
-    # 4. Scan the Universe
-    for symbol, df in market_data.items():
-        # A. Check Cooldown
-        if manager.is_cooling_down(symbol):
-            continue
-
-        # B. Run Math Scanner
-        scanner = StructuralScanner(df)
-        breakout_candidates = scanner.evaluate_breakout()
-        
-        if not breakout_candidates:
-            continue
-
-        # C. Get Zones (for context)
-        zones = scanner._find_structural_zones()
-
-        # D. Agentic Evaluation
-        for candidate in breakout_candidates:
-            # The Evaluator applies the "Context" filter (Regime + Location)
-            alert_prompt = evaluator.evaluate_signal(symbol, candidate, zones)
-            
-            if alert_prompt:
-                print(f"🔔 Breakout Detected: {symbol}")
-                
-                # E. LLM Narrative
-                final_message = generate_llm_summary(alert_prompt)
-                
-                # F. Send & Log
-                telegram.send(final_message)
-                manager.log_alert(symbol, candidate)
-                alerts_triggered += 1
-                
-                # Sleep briefly to avoid Telegram rate limits
-                time.sleep(1)
-
-    # 5. Final Report
+    # 5. Pre-filter: cheap last-bar checks across the universe before any zone analysis
+    # (panel mode runs the full indicator checks for the whole universe in one pass instead)
+    with metrics.stage("prefilter"):
+        if PANEL_SCAN:
+            survivors = UniversePanel.from_frames(market_data, depth=LATEST_DEPTH).latest_candidates()
+        else:
+            survivors = prefilter_universe(market_data)
+    print(f"🔎 Pre-filter: {len(survivors)}/{len(market_data)} symbols go on to structural analysis")
+    market_data = {symbol: market_data[symbol] for symbol in survivors}
+
+    # 6. Scan the Universe (alerts are delivered concurrently as they are found)
+    alerts_triggered = asyncio.run(_scan_and_deliver(market_data, manager, evaluator, telegram, metrics, pipeline))
+
+    # 7. Fold this run's journal into alert_history.json
+    manager.compact()
+
+    # 8. Final Report
     if alerts_triggered == 0:
         print("✅ Scan Complete. No structural breakouts detected today.")
         # Optional: Send a "Heartbeat" message to know it ran
@@ -178,5 +200,80 @@ def main():
     else:
         print(f"✅ Scan Complete. Sent {alerts_triggered} alerts.")
 
+async def _scan_and_deliver(market_data, manager, evaluator, telegram, metrics, pipeline):
+    """
+    Scans symbol by symbol, pushing accepted alerts onto the delivery queue.
+    LLM narration and Telegram sends overlap with the rest of the scan.
+    Returns the number of alerts delivered.
+    """
+    dispatcher = AlertDispatcher(
+        narrate=generate_llm_summary,
+        send=telegram.send,
+        on_sent=manager.log_alert,
+        llm_concurrency=LLM_CONCURRENCY,
+        telegram_rate=TELEGRAM_RATE,
+        telegram_burst=TELEGRAM_BURST,
+        metrics=metrics,
+        narrate_batch=functools.partial(generate_llm_batch, evaluator=evaluator) if LLM_BATCH_SIZE > 1 else None,
+        batch_size=LLM_BATCH_SIZE
+    )
+    dispatcher.start()
+
+    for symbol, df in market_data.items():
+        with metrics.stage("scan"), metrics.timed("symbol_scan_seconds"):
+            accepted = _scan_symbol(symbol, df, evaluator, pipeline)
+
+        for candidate, alert_prompt in accepted:
+            print(f"🔔 Breakout Detected: {symbol}")
+            dispatcher.submit(symbol, candidate, alert_prompt)
+
+        # Let the delivery stage pick up finished LLM/Telegram calls
+        await asyncio.sleep(0)
+
+    # Drain whatever is still in flight (LLM and Telegram time is in the narrate/deliver stages)
+    with metrics.stage("drain"):
+        await dispatcher.close()
+    return dispatcher.sent
+
+def _scan_symbol(symbol, df, evaluator, pipeline):
+    """Scanner -> Evaluator for one symbol (cooldown is already applied). Returns [(candidate, alert_prompt)]."""
+    # A. Run Math Scanner (indicators advance incrementally from the stored state)
+    scanner = StructuralScanner(df, zone_clustering=ZONE_CLUSTERING,
+                                indicators=pipeline.indicator_state(symbol, df), annotate=False)
+    result = scanner.scan()
+    
+    if not result.candidates:
+        return []
+
+    # B. Agentic Evaluation (against the zones the scan already built)
+    accepted = []
+    for candidate in result.candidates:
+        # The Evaluator applies the "Context" filter (Regime + Location)
+        alert_prompt = evaluator.evaluate_signal(symbol, candidate, result.zones)
+        if alert_prompt:
+            accepted.append((candidate, alert_prompt))
+    return accepted
+
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="PSX structural breakout scanner.")
+    parser.add_argument("--metrics", help="Write stage timings and latency histograms here ('-' for stdout)")
+    parser.add_argument("--metrics-format", choices=["jsonl", "prometheus"], default="jsonl")
+    parser.add_argument("--profile", help="Profile the run and dump the profiler output to this file")
+    parser.add_argument("--profiler", choices=["cprofile", "pyinstrument"], default="cprofile")
+    parser.add_argument("--llm-stub", action="store_true", help="Narrate via a local stand-in completion endpoint")
+    args = parser.parse_args()
+
+    if args.llm_stub:
+        stub = StubCompletionServer().start()
+        OPENAI_BASE_URL = stub.base_url
+        OPENAI_API_KEY = OPENAI_API_KEY or "stub"
+
+    run_metrics = RunMetrics()
+    if args.profile:
+        with profiled(args.profile, args.profiler):
+            main(metrics=run_metrics)
+    else:
+        main(metrics=run_metrics)
+
+    if args.metrics:
+        run_metrics.write(args.metrics, args.metrics_format)
\ No newline at end of file
@@ -0,0 +1,108 @@
+import numpy as np
+import pandas as pd
+
+from scanner import breakout_mask, compute_metrics
+
+PANEL_FIELDS = ('high', 'low', 'close', 'volume')
+# Bars needed for exact indicators on the latest bar: 20-bar ATR of true ranges
+# (each needs the previous close) plus the day before for the compression check
+LATEST_DEPTH = 22
+
+class UniversePanel:
+    """
+    The universe as 2-D arrays, one per OHLCV field, with a column per symbol.
+
+    Indicators and the zone-independent breakout checks run for every symbol in
+    one pass of NumPy kernels. Each symbol's bars are right-aligned (stacked at the
+    bottom rows with NaN padding on top) rather than placed on a shared calendar,
+    so a rolling window always spans that symbol's own last N bars, exactly as in
+    a per-symbol scan, even when symbols trade on different days. The last row is
+    every symbol's latest bar.
+    """
+    def __init__(self, dates, symbols, bars, order, counts=None):
+        """
+        Args:
+            dates (DatetimeIndex): Union of the held trading dates (rows of the date grid).
+            symbols (list): Column labels.
+            bars (dict): {field: bars x symbols float array} for PANEL_FIELDS, right-aligned.
+            order (ndarray): bars x symbols int array, the date row of each bar (-1 for padding).
+            counts (ndarray): Full history length per symbol, if the panel only holds the latest bars.
+        """
+        self.dates = dates
+        self.symbols = list(symbols)
+        self.bars = bars
+        self.order = order
+        self.held = (order >= 0).sum(axis=0)
+        self.counts = self.held if counts is None else np.asarray(counts)
+        self.bar_number = np.arange(len(order))[:, None] - (len(order) - self.counts)[None, :]
+        self.metrics = None
+
+    @classmethod
+    def from_frames(cls, frames, depth=None):
+        """
+        Builds the panel from {symbol: DataFrame} (lowercase OHLCV columns, DatetimeIndex).
+        With `depth`, only each symbol's last `depth` bars are held (LATEST_DEPTH is
+        enough for the latest bar's checks), which keeps the daily scan O(symbols).
+        """
+        symbols = list(frames)
+        if not symbols:
+            return cls.from_columns([], [], np.empty(0, 'datetime64[ns]'),
+                                    {name: np.empty(0) for name in PANEL_FIELDS})
+        tail = slice(-depth, None) if depth else slice(None)
+        return cls.from_columns(
+            symbols,
+            [len(frames[s].index[tail]) for s in symbols],
+            np.concatenate([frames[s].index.values[tail] for s in symbols]),
+            {name: np.concatenate([frames[s][name].to_numpy()[tail] for s in symbols]) for name in PANEL_FIELDS},
+            counts=[len(frames[s]) for s in symbols]
+        )
+
+    @classmethod
+    def from_columns(cls, symbols, lengths, stamps, columns, counts=None):
+        """
+        Builds the panel from flat columns holding every symbol's bars back to back
+        (the layout of the consolidated Arrow store).
+        Args:
+            symbols (list): Symbols in storage order.
+            lengths (list): Number of bars of each symbol in the columns.
+            stamps (ndarray): datetime64 date of every bar (sorted within a symbol).
+            columns (dict): {field: values} for PANEL_FIELDS, aligned with `stamps`.
+            counts (list): Full history length per symbol when the columns hold only its latest bars.
+        """
+        lengths = np.asarray(lengths, dtype=int)
+        rows = int(lengths.max()) if len(lengths) else 0
+
+        # Each bar's column and right-aligned row (filled symbol-major, then
+        # transposed, so each symbol's bars are written contiguously)
+        dates = np.sort(pd.unique(stamps))
+        cols = np.repeat(np.arange(len(symbols)), lengths)
+        position = np.arange(len(stamps)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        bar_rows = rows - lengths[cols] + position
+
+        order = np.full((len(symbols), rows), -1)
+        order[cols, bar_rows] = dates.searchsorted(stamps)
+        bars = {}
+        for name in PANEL_FIELDS:
+            bars[name] = np.full((len(symbols), rows), np.nan)
+            bars[name][cols, bar_rows] = columns[name]
+        return cls(pd.DatetimeIndex(dates), symbols, {name: values.T for name, values in bars.items()},
+                   order.T, counts)
+
+    def calculate_metrics(self):
+        """TR, ATRs, compression ratio and volume SMA for every symbol (right-aligned layout)."""
+        if self.metrics is None:
+            bars = self.bars
+            self.metrics = compute_metrics(bars['high'], bars['low'], bars['close'], bars['volume'])
+        return self.metrics
+
+    def candidate_mask(self, min_liquidity_pkr=10_000_000):
+        """Bars that pass every evaluate_breakout check except the zone match (right-aligned layout)."""
+        return breakout_mask(self.bars['close'], self.bars['volume'], self.calculate_metrics(),
+                             self.bar_number, min_liquidity_pkr)
+
+    def latest_candidates(self, min_liquidity_pkr=10_000_000):
+        """Symbols whose latest bar needs the zone check. Returns: List of symbols, in panel order."""
+        if not len(self.bar_number):
+            return []
+        latest = self.candidate_mask(min_liquidity_pkr)[-1]
+        return [symbol for symbol, passed in zip(self.symbols, latest) if passed]
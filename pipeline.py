@@ -1,23 +1,32 @@
-import yfinance as yf
 import pandas as pd
 import numpy as np
+import pyarrow as pa
+import json
 import os
 from pathlib import Path
 from datetime import datetime, timedelta
+from providers import YahooProvider
+from indicators import IndicatorState
+from panel import UniversePanel, PANEL_FIELDS
 
 class PSXDataPipeline:
-    def __init__(self, storage_path="./data_store", suffix=".KA"):
+    def __init__(self, storage_path="./data_store", suffix=".KA", provider=None, history_period="2y"):
         """
         Args:
             storage_path (str): Directory for cache (not strictly needed for GitHub Actions but good for local dev).
             suffix (str): Exchange suffix for Yahoo Finance (default '.KA' for Karachi).
+            provider (DataProvider): Source of raw bars (default: live Yahoo Finance).
+            history_period (str): How much history a full download fetches (default '2y').
         """
         self.storage_path = Path(storage_path)
         self.suffix = suffix
+        self.provider = provider or YahooProvider()
+        self.history_period = history_period
         self.storage_path.mkdir(parents=True, exist_ok=True)
         
         # Core Liquid Universe (Add/Remove as needed)
-        self.universe = [
+        # Offline providers (fixtures, synthetic data) bring their own symbol list
+        self.universe = self.provider.default_universe() or [
             "SYS", "TRG", "LUCK", "ENGRO", "OGDC", "PPL", "HUBC", "UBL", "MCB", "HBL",
             "MEBL", "PSO", "ATRL", "NRL", "SEARLE", "UNITY", "NETSOL", "AVN", "PAEL",
             "GGL", "TELE", "TPL", "PIOC", "DGKC", "CHCC", "FCCL", "KAPCO", "EFERT",
@@ -37,58 +46,66 @@ class PSXDataPipeline:
         2. Minimum history length
         3. Drop zero-volume days (holidays/suspensions)
         """
+        df = self._clean_bars(df)
+        if df is None:
+            return None
+        
+        # Require at least 200 days for SMA200 / Regime filters
+        if len(df) < 200:
+            return None
+
+        return df
+
+    def _clean_bars(self, df):
+        """Drops zero-volume days and standardizes columns to lowercase. None if nothing is left."""
         if df is None or df.empty:
             return None
             
         # Drop days with 0 volume (distorts volatility/ATR)
         df = df[df['Volume'] > 0].copy()
-        
-        # Require at least 200 days for SMA200 / Regime filters
-        if len(df) < 200:
+        if df.empty:
             return None
 
         # Standardize columns to lowercase
         df.columns = [c.lower() for c in df.columns]
         return df
 
-    def update_universe(self):
+    def _download(self, normalized_symbols, period=None, start=None):
+        """
+        Batch download through the configured provider.
+        Returns: Dictionary of {clean_name: raw dataframe}, or None if the request failed.
+        """
+        try:
+            frames = self.provider.download(normalized_symbols, period=period, start=start)
+        except Exception as e:
+            print(f"❌ Batch download failed: {e}")
+            return None
+
+        return {symbol.replace(self.suffix, ""): df for symbol, df in frames.items()}
+
+    def update_universe(self, incremental=False):
         """
         Fetches fresh data for the entire universe.
+        With incremental=True only the bars after each symbol's last stored date are
+        downloaded and appended to the partitioned store (see sync_universe).
         Returns: Dictionary of {symbol: dataframe} to keep in memory (optimized for Cloud/GitHub Actions).
         """
+        if incremental:
+            return self.sync_universe()
+
         normalized_symbols = [self._normalize_symbol(s) for s in self.universe]
         data_cache = {}
         
         print(f"🔄 Fetching data for {len(normalized_symbols)} symbols...")
         
         # Batch download (Much faster)
-        try:
-            data = yf.download(
-                normalized_symbols, 
-                period="2y", 
-                group_by='ticker', 
-                threads=True,
-                progress=False,
-                auto_adjust=True
-            )
-        except Exception as e:
-            print(f"❌ Batch download failed: {e}")
+        frames = self._download(normalized_symbols, period=self.history_period)
+        if frames is None:
             return {}
 
-        for symbol in normalized_symbols:
-            clean_name = symbol.replace(self.suffix, "")
-            
-            # Extract specific ticker DF from the multi-index
-            if len(normalized_symbols) > 1:
-                try:
-                    df_sym = data[symbol].copy()
-                except KeyError:
-                    continue
-            else:
-                df_sym = data.copy()
-            
+        for clean_name, df_sym in frames.items():
             # Validate
-            clean_df = self._validate_data(df_sym, symbol)
+            clean_df = self._validate_data(df_sym, clean_name)
             
             if clean_df is not None:
                 # Save to memory dict
@@ -96,8 +113,225 @@ class PSXDataPipeline:
                 # Optional: Save to disk for local debugging
                 clean_df.to_parquet(self.storage_path / f"{clean_name}.parquet")
         
+        self.write_universe_store(data_cache)
+        return data_cache
+
+    # --- Incremental Store ---
+    # Layout: {storage_path}/ohlcv/symbol={SYMBOL}/{last_date:%Y%m%d}.parquet
+    # Each sync appends one part per symbol; part names carry the last bar's date,
+    # so the newest stored date is known from a directory listing alone.
+    MAX_PARTS = 30  # Parts per symbol before they are compacted into one
+
+    def _partition_dir(self, clean_name):
+        return self.storage_path / "ohlcv" / f"symbol={clean_name}"
+
+    def _last_stored_date(self, clean_name):
+        parts = sorted(self._partition_dir(clean_name).glob("*.parquet"))
+        if not parts:
+            return None
+        return pd.Timestamp(datetime.strptime(parts[-1].stem, "%Y%m%d"))
+
+    def _append_bars(self, clean_name, df):
+        """Appends new bars as a new part file, compacting once too many parts pile up."""
+        part_dir = self._partition_dir(clean_name)
+        part_dir.mkdir(parents=True, exist_ok=True)
+        df.to_parquet(part_dir / f"{df.index[-1]:%Y%m%d}.parquet")
+
+        if len(list(part_dir.glob("*.parquet"))) > self.MAX_PARTS:
+            self._replace_partition(clean_name, self._read_partition(clean_name))
+
+    def _replace_partition(self, clean_name, df):
+        """
+        Stores `df` as the symbol's only part. The new part is renamed into place
+        before the old ones are deleted: after a crash in between, it is still the
+        newest part, so its bars win when the partition is read.
+        """
+        part_dir = self._partition_dir(clean_name)
+        part_dir.mkdir(parents=True, exist_ok=True)
+        target = part_dir / f"{df.index[-1]:%Y%m%d}.parquet"
+        tmp_path = part_dir / "compact.tmp"
+        df.to_parquet(tmp_path)
+        os.replace(tmp_path, target)
+        for part in part_dir.glob("*.parquet"):
+            if part != target:
+                part.unlink()
+
+    def _stored_close(self, clean_name, date):
+        """Close stored for `date` in the newest part (where the last stored bar lives), or None."""
+        parts = sorted(self._partition_dir(clean_name).glob("*.parquet"))
+        if not parts:
+            return None
+        last_part = pd.read_parquet(parts[-1], columns=['close'])
+        return last_part['close'].get(date)
+
+    def _read_partition(self, clean_name):
+        parts = sorted(self._partition_dir(clean_name).glob("*.parquet"))
+        if not parts:
+            return None
+        df = pd.concat([pd.read_parquet(p) for p in parts])
+        return df[~df.index.duplicated(keep='last')].sort_index()
+
+    def sync_universe(self, history_period=None):
+        """
+        Incremental sync: reads the last stored date of every symbol, downloads only
+        the bars from that date on (symbols sharing a start date go in one batch
+        request) and appends the new ones to the partitioned store. Symbols with no
+        history yet are bootstrapped with `history_period`.
+        Prices are adjusted, so a split or dividend rescales the whole history: the
+        re-downloaded last stored bar is checked against the stored one (as
+        IndicatorState.advance does) and on a mismatch the symbol is re-bootstrapped.
+        Returns: Dictionary of {symbol: dataframe} with the full stored history.
+        """
+        history_period = history_period or self.history_period
+        normalized_symbols = [self._normalize_symbol(s) for s in self.universe]
+        today = pd.Timestamp(datetime.now().date())
+
+        # Group symbols by the first date they are missing
+        batches = {}
+        for symbol in normalized_symbols:
+            last_date = self._last_stored_date(symbol.replace(self.suffix, ""))
+            if last_date is not None and last_date + timedelta(days=1) > today:
+                continue # Already up to date
+            batches.setdefault(last_date, []).append(symbol)
+
+        rebootstrap = []
+        for start, symbols in batches.items():
+            if start is None:
+                print(f"🔄 Bootstrapping {len(symbols)} symbols ({history_period})...")
+                frames = self._download(symbols, period=history_period)
+            else:
+                print(f"🔄 Syncing {len(symbols)} symbols from {start.date()}...")
+                frames = self._download(symbols, start=start.strftime("%Y-%m-%d"))
+            if frames is None:
+                continue
+
+            for clean_name, df_sym in frames.items():
+                new_bars = self._clean_bars(df_sym)
+                if new_bars is None:
+                    continue
+                if start is not None:
+                    # The overlapping bar must match what is stored, else the history was re-adjusted
+                    stored_close = self._stored_close(clean_name, start)
+                    if (start not in new_bars.index or stored_close is None
+                            or not np.isclose(new_bars.at[start, 'close'], stored_close)):
+                        rebootstrap.append(clean_name + self.suffix)
+                        continue
+                    new_bars = new_bars[new_bars.index > start]
+                if not new_bars.empty:
+                    self._append_bars(clean_name, new_bars)
+
+        if rebootstrap:
+            print(f"🔄 Re-bootstrapping {len(rebootstrap)} symbols with revised history ({history_period})...")
+            frames = self._download(rebootstrap, period=history_period) or {}
+            for clean_name, df_sym in frames.items():
+                full = self._clean_bars(df_sym)
+                if full is not None:
+                    self._replace_partition(clean_name, full)
+
+        data_cache = {}
+        for symbol in normalized_symbols:
+            clean_name = symbol.replace(self.suffix, "")
+            df = self._read_partition(clean_name)
+            if df is not None and len(df) >= 200:
+                data_cache[clean_name] = df
+
+        self.write_universe_store(data_cache)
+        return data_cache
+
+    # --- Columnar Universe Store ---
+    # One uncompressed Arrow IPC file for the whole universe, one record batch per
+    # symbol (rows sorted by date). The symbol -> batch map lives in the schema
+    # metadata, so a memory-mapped reader can jump straight to the batches it needs.
+    UNIVERSE_FILE = "universe.arrow"
+    STORE_COLUMNS = ['open', 'high', 'low', 'close', 'volume']
+
+    def write_universe_store(self, data_cache):
+        """Writes {symbol: dataframe} as the consolidated store (atomic temp-file + rename)."""
+        if not data_cache:
+            return
+        schema = pa.schema(
+            [('date', pa.timestamp('ns'))] + [(c, pa.float64()) for c in self.STORE_COLUMNS],
+            metadata={b'symbols': json.dumps(list(data_cache)).encode()}
+        )
+        tmp_path = self.storage_path / f"{self.UNIVERSE_FILE}.tmp"
+        with pa.OSFile(str(tmp_path), 'wb') as sink:
+            with pa.ipc.new_file(sink, schema) as writer:
+                for df in data_cache.values():
+                    df = df.sort_index()
+                    arrays = [pa.array(df.index.values.astype('datetime64[ns]'))]
+                    arrays += [pa.array(df[c].values.astype(float)) for c in self.STORE_COLUMNS]
+                    writer.write_batch(pa.record_batch(arrays, schema=schema))
+        os.replace(tmp_path, self.storage_path / self.UNIVERSE_FILE)
+
+    def load_universe(self, symbols=None, start=None, end=None):
+        """
+        Memory-maps the consolidated store and returns {symbol: dataframe}.
+        Only the batches of the requested `symbols` are touched, and the [start, end]
+        date range is cut by binary search on the sorted date column, so the
+        returned frames are zero-copy views over the mapped file.
+        """
+        path = self.storage_path / self.UNIVERSE_FILE
+        if not path.exists():
+            return {}
+
+        reader = pa.ipc.open_file(pa.memory_map(str(path), 'r'))
+        stored = json.loads(reader.schema.metadata[b'symbols'])
+        batch_no = {symbol: n for n, symbol in enumerate(stored)}
+        wanted = stored if symbols is None else [s for s in symbols if s in batch_no]
+        lo = None if start is None else np.datetime64(pd.Timestamp(start), 'ns')
+        hi = None if end is None else np.datetime64(pd.Timestamp(end), 'ns')
+
+        data_cache = {}
+        for symbol in wanted:
+            batch = reader.get_batch(batch_no[symbol])
+            dates = batch.column(0).to_numpy()
+            first = 0 if lo is None else np.searchsorted(dates, lo, side='left')
+            last = len(dates) if hi is None else np.searchsorted(dates, hi, side='right')
+            if last <= first:
+                continue
+            batch = batch.slice(first, last - first)
+            data_cache[symbol] = pd.DataFrame(
+                {c: batch.column(c).to_numpy() for c in self.STORE_COLUMNS},
+                index=pd.DatetimeIndex(batch.column(0).to_numpy(), name='Date'),
+                copy=False
+            )
         return data_cache
 
+    def load_panel(self):
+        """
+        The consolidated store as a UniversePanel, built straight from the mapped
+        Arrow columns (no per-symbol DataFrames). Returns None if there is no store.
+        """
+        path = self.storage_path / self.UNIVERSE_FILE
+        if not path.exists():
+            return None
+
+        reader = pa.ipc.open_file(pa.memory_map(str(path), 'r'))
+        table = reader.read_all()
+        return UniversePanel.from_columns(
+            json.loads(reader.schema.metadata[b'symbols']),
+            [reader.get_batch(i).num_rows for i in range(reader.num_record_batches)],
+            table.column('date').to_numpy(),
+            {c: table.column(c).to_numpy() for c in PANEL_FIELDS}
+        )
+
+    def indicator_state(self, symbol, df):
+        """
+        Incremental indicator state for `symbol`, advanced to the last bar of `df`.
+        The state lives next to the OHLCV store ({storage_path}/indicators/{symbol}.json),
+        so a daily run only processes the new bars. It is rebuilt from the full frame
+        when missing or when the stored history no longer matches (e.g. price adjustments).
+        """
+        state_dir = self.storage_path / "indicators"
+        state_dir.mkdir(parents=True, exist_ok=True)
+        state_path = state_dir / f"{symbol}.json"
+
+        state = IndicatorState.load(state_path)
+        if state is None or not state.advance(df):
+            state = IndicatorState.from_frame(df)
+        state.save(state_path)
+        return state
+
     def load_data(self, symbol, memory_cache=None):
         """
         Loads data either from the passed memory_cache (Cloud mode) or disk (Local mode).
@@ -110,20 +344,51 @@ class PSXDataPipeline:
         file_path = self.storage_path / f"{symbol}.parquet"
         if file_path.exists():
             return pd.read_parquet(file_path)
-            
-        return None
+
+        # Priority 3: Incremental Store
+        return self._read_partition(symbol)
+
+    # --- Market Index ---
+    # ^KSE is the ticker for KSE-100 Index on Yahoo
+    # If unavailable, you might use a major ETF or proxy like 'OGDC.KA'
+    INDEX_TICKER = "^KSE"
+    INDEX_NAME = "KSE100" # Partition name in the incremental store
+
+    def sync_index(self, history_period=None):
+        """
+        Appends the KSE-100 bars newer than the stored ones to the incremental store
+        (the first call bootstraps `history_period`, by default the same history as
+        the stocks so replays have a regime for every bar). Index bars are stored as
+        downloaded: unlike stocks, the index may report zero volume.
+        """
+        last_date = self._last_stored_date(self.INDEX_NAME)
+        if last_date is None:
+            start = None
+            frames = self.provider.download([self.INDEX_TICKER], period=history_period or self.history_period)
+        else:
+            start = last_date + timedelta(days=1)
+            if start > pd.Timestamp(datetime.now().date()):
+                return # Already up to date
+            frames = self.provider.download([self.INDEX_TICKER], start=start.strftime("%Y-%m-%d"))
+
+        new_bars = frames.get(self.INDEX_TICKER)
+        if new_bars is None or new_bars.empty:
+            return
+        new_bars = new_bars.copy()
+        new_bars.columns = [c.lower() for c in new_bars.columns]
+        if start is not None:
+            new_bars = new_bars[new_bars.index >= start]
+        if not new_bars.empty:
+            self._append_bars(self.INDEX_NAME, new_bars)
 
     def get_market_regime(self):
         """
-        Fetches KSE-100 data to determine broad market health.
+        KSE-100 history to determine broad market health, from the local store.
+        Only bars newer than the stored ones are downloaded; if that fails (or
+        there is no network) the stored history is returned as it is.
         """
         try:
-            # ^KSE is the ticker for KSE-100 Index on Yahoo
-            # If unavailable, you might use a major ETF or proxy like 'OGDC.KA'
-            kse100 = yf.download("^KSE", period="1y", progress=False, auto_adjust=True)
-            if not kse100.empty:
-                kse100.columns = [c.lower() for c in kse100.columns]
-                return kse100
-        except:
-            pass
-        return None
\ No newline at end of file
+            self.sync_index()
+        except Exception as e:
+            print(f"⚠️ Index sync failed, using stored KSE-100 bars: {e}")
+        return self._read_partition(self.INDEX_NAME)
\ No newline at end of file
@@ -0,0 +1,160 @@
+import zlib
+import pandas as pd
+import numpy as np
+from pathlib import Path
+from scipy.signal import lfilter
+
+def _trailing_window(df, period=None, start=None):
+    """Applies yfinance-style `period` ('1y', '2y', '90d') or `start` filtering to a frame."""
+    if start is not None:
+        return df[df.index >= pd.Timestamp(start)]
+    if period is not None and len(df):
+        count, unit = int(period[:-1]), period[-1]
+        offset = pd.DateOffset(years=count) if unit == 'y' else pd.DateOffset(days=count)
+        return df[df.index > df.index[-1] - offset]
+    return df
+
+class DataProvider:
+    """
+    Source of raw daily bars. Implementations return Yahoo-style frames
+    (DatetimeIndex, capitalized OHLCV columns) keyed by the requested ticker.
+    """
+    def download(self, tickers, period=None, start=None):
+        """Returns {ticker: raw dataframe}. Raises on a failed request."""
+        raise NotImplementedError
+
+    def default_universe(self):
+        """Symbols this source knows about, or None to keep the pipeline's own list."""
+        return None
+
+class YahooProvider(DataProvider):
+    """Live Yahoo Finance data (batch download)."""
+    def download(self, tickers, period=None, start=None):
+        import yfinance as yf
+
+        kwargs = {'period': period} if start is None else {'start': start}
+        data = yf.download(
+            tickers,
+            group_by='ticker',
+            threads=True,
+            progress=False,
+            auto_adjust=True,
+            **kwargs
+        )
+
+        frames = {}
+        for ticker in tickers:
+            # Extract specific ticker DF from the multi-index
+            if isinstance(data.columns, pd.MultiIndex):
+                try:
+                    frames[ticker] = data[ticker].copy()
+                except KeyError:
+                    continue
+            else:
+                frames[ticker] = data.copy()
+        return frames
+
+class LocalProvider(DataProvider):
+    """
+    Offline fixtures: one `{TICKER}.parquet` or `{TICKER}.csv` per symbol in `path`
+    (exchange suffix optional). `period` is measured back from each file's last bar,
+    so fixtures replay identically whenever they are read.
+    """
+    def __init__(self, path, suffix=".KA"):
+        self.path = Path(path)
+        self.suffix = suffix
+
+    def _find(self, ticker):
+        for name in (ticker, ticker.replace(self.suffix, "")):
+            for ext in (".parquet", ".csv"):
+                candidate = self.path / f"{name}{ext}"
+                if candidate.exists():
+                    return candidate
+        return None
+
+    def download(self, tickers, period=None, start=None):
+        frames = {}
+        for ticker in tickers:
+            file_path = self._find(ticker)
+            if file_path is None:
+                continue
+            if file_path.suffix == ".csv":
+                df = pd.read_csv(file_path, index_col=0, parse_dates=True)
+            else:
+                df = pd.read_parquet(file_path)
+            df.columns = [c.capitalize() for c in df.columns]
+            frames[ticker] = _trailing_window(df.sort_index(), period, start)
+        return frames
+
+    def default_universe(self):
+        names = {p.stem for p in self.path.glob("*.parquet")} | {p.stem for p in self.path.glob("*.csv")}
+        return sorted(n.replace(self.suffix, "") for n in names if not n.startswith("^")) or None
+
+class SyntheticProvider(DataProvider):
+    """
+    Deterministic synthetic OHLCV for offline runs and benchmarks.
+
+    Each ticker gets its own seeded random stream (CRC32 of the name), so a symbol's
+    history is identical across runs and independent of the universe size. Prices
+    drift inside horizontal ranges that are periodically broken on a volume spike,
+    which gives the scanner real zones and breakouts to find.
+    """
+    def __init__(self, symbols=30, years=2, end="2024-12-31", seed=0):
+        self.symbols = symbols
+        self.years = years
+        self.end = pd.Timestamp(end)
+        self.seed = seed
+
+    def default_universe(self):
+        return [f"SYN{i:04d}" for i in range(self.symbols)]
+
+    def _generate(self, ticker):
+        rng = np.random.default_rng([self.seed, zlib.crc32(ticker.encode())])
+        n = 252 * self.years
+        dates = pd.bdate_range(end=self.end, periods=n)
+
+        # Range regimes: price mean-reverts under a ceiling, which is broken and
+        # re-based every 60-180 sessions
+        ceiling = np.empty(n)
+        breaks = np.zeros(n, dtype=bool)
+        level, t = rng.uniform(20, 500), 0
+        while t < n:
+            span = int(rng.integers(60, 180))
+            ceiling[t:t + span] = level
+            if t + span < n:
+                breaks[t + span] = True
+            level *= rng.uniform(0.9, 1.25)
+            t += span
+
+        # Log close is an AR(1) pulled 8% a day towards 96% of the ceiling; on a break
+        # day it also jumps half of the way to the new range
+        pull = 0.08
+        log_target = np.log(ceiling * 0.96)
+        shocks = rng.normal(0, 0.015, n)
+        shocks[1:] += 0.5 * np.diff(log_target) * breaks[1:]
+        log_close = lfilter([1.0], [1.0, pull - 1], pull * log_target + shocks,
+                            zi=[(1 - pull) * log_target[0]])[0]
+        close = np.exp(log_close)
+
+        spread = np.abs(rng.normal(0, 0.01, (2, n))) * close
+        open_ = close * (1 + rng.normal(0, 0.004, n))
+        high = np.maximum(close, open_) + spread[0]
+        low = np.minimum(close, open_) - spread[1]
+        # Roughly PKR 100M daily turnover
+        volume = rng.lognormal(np.log(1e8 / close), 0.35).round()
+        volume[breaks] *= rng.uniform(2.0, 4.0, breaks.sum())
+
+        return pd.DataFrame(
+            {'Open': open_, 'High': high, 'Low': low, 'Close': close, 'Volume': volume},
+            index=pd.DatetimeIndex(dates, name='Date')
+        )
+
+    def download(self, tickers, period=None, start=None):
+        return {t: _trailing_window(self._generate(t), period, start) for t in tickers}
+
+def make_provider(name="yahoo", **kwargs):
+    """Factory used by the CLIs: 'yahoo', 'local' (path=...), 'synthetic' (symbols=, years=)."""
+    providers = {'yahoo': YahooProvider, 'local': LocalProvider, 'synthetic': SyntheticProvider}
+    if name not in providers:
+        raise ValueError(f"Unknown data provider: {name}")
+    return providers[name](**kwargs)
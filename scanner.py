@@ -1,14 +1,438 @@
 import pandas as pd
 import numpy as np
-from scipy.signal import argrelextrema
+from collections import deque
+from itertools import islice
+
+try:
+    from numba import njit # Optional: compiled fractal kernel
+except ImportError:
+    njit = None
+
+METRIC_COLUMNS = ('tr', 'atr_5', 'atr_14', 'atr_20', 'compression_ratio', 'vol_sma_20')
+
+def _readonly(values):
+    """Read-only view of an array (the underlying data is shared, not copied)."""
+    view = np.asarray(values).view()
+    view.flags.writeable = False
+    return view
+
+def allocate_metrics(shape):
+    """Preallocated indicator buffers for `shape` (bars, or bars x symbols)."""
+    return {name: np.empty(shape) for name in METRIC_COLUMNS}
+
+def _rolling_mean(values, window, out):
+    """
+    Trailing mean along axis 0 into `out`: NaN until the window is full and while it holds a NaN.
+    Sums `window` shifted slices in place, so a panel costs the same per cell as a single series.
+    """
+    out[:window - 1] = np.nan
+    n = len(values)
+    if n >= window:
+        total = out[window - 1:]
+        total[...] = values[:n - window + 1]
+        for k in range(1, window):
+            total += values[k:n - window + 1 + k]
+        total /= window
+    return out
+
+def _previous(values):
+    """Each bar's previous value along axis 0 (NaN for the first bar)."""
+    prev = np.empty(np.shape(values))
+    prev[:1] = np.nan
+    prev[1:] = values[:-1]
+    return prev
+
+def compute_metrics(high, low, close, volume, out=None):
+    """
+    Array version of StructuralScanner._calculate_metrics.
+    Reads the price arrays without copying or modifying them and writes every
+    indicator into `out` (see allocate_metrics), so equal-length series can
+    reuse one set of buffers. Bars run along axis 0, so a 2-D bars x symbols
+    panel is processed in one pass. Returns `out`.
+    """
+    if out is None:
+        out = allocate_metrics(np.shape(close))
+    if len(close) == 0:
+        return out
+
+    # True Range; compression_ratio doubles as scratch space until the end
+    tr, scratch = out['tr'], out['compression_ratio']
+    np.subtract(high, low, out=tr)
+    tr[0] = np.nan # No previous close
+    for side in (high, low):
+        np.subtract(side[1:], close[:-1], out=scratch[1:])
+        np.abs(scratch[1:], out=scratch[1:])
+        np.maximum(tr[1:], scratch[1:], out=tr[1:])
+
+    # ATRs and Volume SMA
+    for name, window in (('atr_14', 14), ('atr_5', 5), ('atr_20', 20)):
+        _rolling_mean(tr, window, out[name])
+    _rolling_mean(volume, 20, out['vol_sma_20'])
+
+    # Volatility Compression Ratio (VCR)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        np.divide(out['atr_5'], out['atr_20'], out=scratch)
+    return out
+
+def _fractal_loop(values, order, out):
+    """Scalar fractal scan (compiled with Numba when available). Returns the number of hits."""
+    n = len(values)
+    count = 0
+    for i in range(n):
+        peak = True
+        for j in range(max(0, i - order), min(n, i + order + 1)):
+            if not values[i] >= values[j]:
+                peak = False
+                break
+        if peak:
+            out[count] = i
+            count += 1
+    return count
+
+_fractal_kernel = njit(cache=True)(_fractal_loop) if njit else None
+
+def fractal_highs(values, order=5):
+    """
+    Indices of fractal highs: bars whose value is >= every value within `order`
+    bars on either side, the window being clipped at the ends of the series.
+    Same result as argrelextrema(values, np.greater_equal, order=order) (ties
+    count, and a NaN anywhere in the window rules the bar out), in one pass over
+    the whole history: a vectorized sliding-window max, or the Numba kernel when
+    numba is installed.
+    """
+    values = np.asarray(values)
+    if len(values) == 0:
+        return np.empty(0, dtype=np.intp)
+    if _fractal_kernel is not None:
+        out = np.empty(len(values), dtype=np.intp)
+        return out[:_fractal_kernel(values, order, out)]
+
+    # Max over the window, built from 2 * order shifted slices. Neighbours past
+    # either end are simply skipped, which is what argrelextrema's clip mode
+    # amounts to (the clipped index is the first/last bar, already in the window).
+    window_max = np.array(values)
+    for k in range(1, order + 1):
+        np.maximum(window_max[k:], values[:-k], out=window_max[k:])
+        np.maximum(window_max[:-k], values[k:], out=window_max[:-k])
+    return np.flatnonzero(values >= window_max)
+
+def _add_to_zones(zones, price, tolerance):
+    """Assigns one fractal high to the first zone within tolerance (in place)."""
+    for zone in zones:
+        # Check if price is within X% of an existing zone
+        if abs(zone['level'] - price) / zone['level'] <= tolerance:
+            zone['touches'] += 1
+            # Keep the higher level to avoid false breakouts
+            zone['level'] = max(zone['level'], price)
+            return
+    zones.append({'level': price, 'touches': 1})
+
+def _cluster_sorted(highs, tolerance):
+    """
+    Order-independent clustering: sorts the highs and cuts a new zone whenever a
+    price is more than `tolerance` above the lowest high of the current zone.
+    Every member is then within tolerance of the zone level (its highest high).
+    Every price's zone end comes from one vectorized searchsorted; which prices
+    anchor a zone depends on where the previous zone ended, so that part is
+    inherently step by step (one integer hop per zone).
+    """
+    prices = np.sort(np.asarray(highs, dtype=float))
+    prices = prices[~np.isnan(prices)]
+    if len(prices) == 0:
+        return []
+
+    # Zone boundaries: a zone anchored at price i ends at the last price <= anchor * (1 + tolerance)
+    stops = np.searchsorted(prices, prices * (1 + tolerance), side='right').tolist()
+    zones = []
+    start = 0
+    while start < len(prices):
+        stop = stops[start]
+        zones.append({'level': prices[stop - 1], 'touches': stop - start})
+        start = stop
+    return zones
+
+def _cluster_highs(highs, tolerance, method="legacy"):
+    """
+    Groups fractal highs into zones.
+    method='sorted' uses the order-independent NumPy grouping;
+    method='legacy' reproduces the original first-match loop over highs in time order.
+    """
+    if method == "legacy":
+        zones = []
+        for price in highs:
+            _add_to_zones(zones, price, tolerance)
+        return zones
+    if method == "sorted":
+        return _cluster_sorted(highs, tolerance)
+    raise ValueError(f"Unknown zone clustering method: {method}")
+
+def _strong_zones(zones, min_touches=3):
+    """Filter: Only strong zones (3+ touches), sorted by level."""
+    valid_zones = [z for z in zones if z['touches'] >= min_touches]
+    return sorted(valid_zones, key=lambda x: x['level'])
+
+class ZoneTracker:
+    """
+    Streaming counterpart of StructuralScanner._find_structural_zones: after each
+    update, zones() equals _find_structural_zones(end=bars_seen) on the same highs.
+
+    Feed one bar's high at a time. An interior fractal high is confirmed once its
+    `order` right-hand bars have arrived and expires once its left neighbourhood
+    leaves the lookback window. The bars within `order` of either window edge see
+    a clipped neighbourhood, as in the batch scan; they are re-checked against the
+    window on each call (at most 2 * order bars, a constant).
+    With legacy clustering, the zones of the head edge plus the interior highs are
+    kept and newly confirmed highs update touch counts in place. First-match
+    clustering depends on the order highs were seen, so those zones are only
+    re-clustered when a high expires or the head edge changes; the tail edge is
+    applied to a copy. Sorted clustering re-groups the (small) set of window highs
+    whenever that set changes.
+    """
+    def __init__(self, lookback=250, tolerance=0.02, order=5, clustering="legacy"):
+        if clustering not in ("legacy", "sorted"):
+            raise ValueError(f"Unknown zone clustering method: {clustering}")
+        self.lookback = lookback
+        self.tolerance = tolerance
+        self.order = order
+        self.clustering = clustering
+        self.bars_seen = 0
+        self._window = deque(maxlen=lookback)  # Highs of the lookback window
+        self._fractals = deque()               # (bar_index, high) of confirmed interior fractals
+        self._base = None                      # Legacy: [head edge, first interior bar, highs folded in, zones]
+        self._sorted = None                    # Sorted: (window fractals key, zones)
+
+    @classmethod
+    def from_highs(cls, highs, **kwargs):
+        """Warms up a tracker from an existing history of highs."""
+        tracker = cls(**kwargs)
+        for high in highs:
+            tracker.update(high)
+        return tracker
+
+    def _is_fractal(self, i, lo, hi):
+        """Whether window position i is >= every high of window positions [lo, hi)."""
+        window = self._window
+        return all(window[i] >= window[j] for j in range(lo, hi))
+
+    def update(self, high):
+        """Consumes the next bar."""
+        self._window.append(high)
+        self.bars_seen += 1
+        start = self.bars_seen - len(self._window)
+
+        # 1. Confirm the bar `order` days back now that its right side is complete
+        candidate = len(self._window) - 1 - self.order
+        if candidate >= self.order and self._is_fractal(candidate, candidate - self.order, len(self._window)):
+            self._fractals.append((start + candidate, self._window[candidate]))
+
+        # 2. Expire highs whose left neighbourhood is no longer entirely inside the window
+        while self._fractals and self._fractals[0][0] < start + self.order:
+            self._fractals.popleft()
+
+    def _edges(self):
+        """Window positions of the fractals on the clipped head and tail edges."""
+        n, order = len(self._window), self.order
+        if n < 2 * order:
+            # Too short for an interior: every bar is an edge bar
+            return [i for i in range(n) if self._is_fractal(i, max(0, i - order), min(n, i + order + 1))], []
+        head = [i for i in range(order) if self._is_fractal(i, 0, i + order + 1)]
+        tail = [i for i in range(n - order, n) if self._is_fractal(i, i - order, n)]
+        return head, tail
+
+    def zones(self, min_touches=3):
+        """Current strong zones, in the same format as _find_structural_zones."""
+        start = self.bars_seen - len(self._window)
+        head, tail = self._edges()
+        first = self._fractals[0][0] if self._fractals else None
+        if self.clustering == "sorted":
+            # Interior highs are appended and expired in order: the first bar and the count identify them
+            key = (start, tuple(head), first, len(self._fractals), tuple(tail))
+            if self._sorted is None or self._sorted[0] != key:
+                prices = [self._window[i] for i in head] + [price for _, price in self._fractals] + \
+                         [self._window[i] for i in tail]
+                self._sorted = (key, _cluster_sorted(prices, self.tolerance))
+            zones = self._sorted[1]
+        else:
+            if self._base is None or self._base[0] != (start, head) or self._base[1] != first:
+                base = []
+                for i in head:
+                    _add_to_zones(base, self._window[i], self.tolerance)
+                self._base = [(start, head), first, 0, base]
+            # Fold in the highs confirmed since the last call, in time order
+            folded, base = self._base[2], self._base[3]
+            for _, price in islice(self._fractals, folded, None):
+                _add_to_zones(base, price, self.tolerance)
+            self._base[2] = len(self._fractals)
+            zones = [dict(z) for z in base]
+            for i in tail:
+                _add_to_zones(zones, self._window[i], self.tolerance)
+        return [dict(z) for z in _strong_zones(zones, min_touches)]
+
+class WalkForwardZones:
+    """
+    Exact _find_structural_zones for every day of a walk-forward replay.
+
+    A bar whose whole +/- `order` neighbourhood lies inside the lookback window is
+    a fractal of the window exactly when it is a fractal of the full history, so
+    those are found once up front. The bars within `order` of a window edge see a
+    clipped neighbourhood; their status depends only on where the window starts
+    (or ends), so it is also precomputed for every start and end, as bit masks.
+    Clustering is memoized on the window's set of fractal bars, which only changes
+    when a fractal is confirmed or expires, so each day costs O(1) lookups.
+    """
+    def __init__(self, highs, lookback=250, tolerance=0.02, order=5, clustering="legacy"):
+        self.highs = np.asarray(highs)
+        self.lookback = lookback
+        self.tolerance = tolerance
+        self.order = order
+        self.clustering = clustering
+        self.fractals = fractal_highs(self.highs, order)
+        self._head, self._tail = self._edge_bits()
+        self._zones = {}
+
+    def _edge_bits(self):
+        """
+        Bit r of head[s]: bar s + r is a fractal of a window starting at bar s.
+        Bit r of tail[e]: bar e - 1 - r is a fractal of a window ending before bar e.
+        (Valid for windows of at least 2 * order bars.)
+        """
+        n, order = len(self.highs), self.order
+        head = np.zeros(n + 1, dtype=np.int64)
+        tail = np.zeros(n + 1, dtype=np.int64)
+        for r in range(order):
+            # The bar plus its `order` neighbours on the unclipped side and r on the clipped side
+            width = r + order + 1
+            if n < width:
+                break
+            window_max = np.lib.stride_tricks.sliding_window_view(self.highs, width).max(axis=1)
+            count = len(window_max)
+            head[:count] |= (self.highs[r:r + count] >= window_max).astype(np.int64) << r
+            tail[width:width + count] |= (self.highs[order:order + count] >= window_max).astype(np.int64) << r
+        return head, tail
+
+    def _edge_fractals(self, bars, start, end):
+        """The bars of `bars` that are fractals of the window [start, end), checked directly."""
+        values = self.highs[start:end].tolist()
+        return tuple(
+            i for i in bars
+            if all(values[i - start] >= v for v in values[max(start, i - self.order) - start:min(end, i + self.order + 1) - start])
+        )
+
+    def zones(self, end):
+        """Strong zones of the lookback window ending before bar `end` (exclusive)."""
+        start = max(0, end - self.lookback)
+        order = self.order
+        if end - start < 2 * order:
+            # Too short for an interior: every bar is an edge bar
+            key = self._edge_fractals(range(start, end), start, end)
+        else:
+            head_bits, tail_bits = int(self._head[start]), int(self._tail[end])
+            head = tuple(start + r for r in range(order) if head_bits >> r & 1)
+            tail = tuple(end - 1 - r for r in reversed(range(order)) if tail_bits >> r & 1)
+            lo = np.searchsorted(self.fractals, start + order)
+            hi = np.searchsorted(self.fractals, end - order)
+            key = head + tuple(self.fractals[lo:hi].tolist()) + tail
+
+        if key not in self._zones:
+            zones = _cluster_highs(self.highs[list(key)], self.tolerance, self.clustering)
+            self._zones[key] = _strong_zones(zones)
+        return [dict(z) for z in self._zones[key]]
+
+def breakout_mask(close, volume, metrics, bar_number, min_liquidity_pkr=10_000_000):
+    """
+    The zone-independent evaluate_breakout checks for every bar at once.
+    Works on a series or a bars x symbols panel (bars along axis 0);
+    `bar_number` is each bar's position in its own symbol's history.
+    Mirrors evaluate_breakout: a NaN comparison never rejects a bar there,
+    so each filter is expressed as "not rejected" rather than "accepted".
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        vol_mult = volume / metrics['vol_sma_20']
+
+    mask = bar_number >= 24                                  # len(df_past) >= 25
+    mask &= ~(close * volume < min_liquidity_pkr)            # 1. Liquidity
+    mask &= _previous(close) < close                         # A. yesterday < level < today
+    mask &= ~(vol_mult < 1.8)                                # C. Volume Expansion
+    mask &= ~(_previous(metrics['compression_ratio']) > 1.0) # D. Compression Context
+    return mask
+
+def prefilter_universe(frames, min_liquidity_pkr=10_000_000, min_vol_mult=1.8):
+    """
+    Stage one of the daily scan: the cheap evaluate_breakout checks for the whole
+    universe at once, on the last 20 bars of each symbol (no indicators, no zones).
+    A symbol is dropped only when evaluate_breakout would certainly reject it:
+    fewer than 25 bars, turnover below the minimum, no up-close, or volume below
+    min_vol_mult times its 20-bar average. NaNs pass, as they do there.
+    Returns: List of the surviving symbols, in input order.
+    """
+    symbols = [symbol for symbol, df in frames.items() if len(df) >= 25]
+    if not symbols:
+        return []
+
+    closes = np.array([frames[s]['close'].to_numpy()[-2:] for s in symbols], dtype=float)
+    volumes = np.array([frames[s]['volume'].to_numpy()[-20:] for s in symbols], dtype=float)
+    prev_close, close = closes[:, 0], closes[:, 1]
+    volume = volumes[:, -1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        vol_mult = volume / volumes.mean(axis=1)
+
+    keep = ~(close * volume < min_liquidity_pkr)             # 1. Liquidity
+    keep &= prev_close < close                               # A. a zone can only be crossed on an up-close
+    # C. Volume Expansion, a hair lenient so rounding differences between the
+    # mean implementations can never drop a bar the full scan would accept
+    keep &= ~(vol_mult < min_vol_mult * (1 - 1e-9))
+    return [symbol for symbol, passed in zip(symbols, keep) if passed]
+
+class ScanResult:
+    """
+    Everything one StructuralScanner.scan() produced:
+    candidates (list or None), the strong zones they were matched against,
+    the indicator arrays (None when an IndicatorState supplied today's values)
+    and today's/yesterday's bars with their indicators.
+    """
+    def __init__(self, candidates, zones, metrics, today=None, yesterday=None):
+        self.candidates = candidates
+        self.zones = zones
+        self.metrics = metrics
+        self.today = today
+        self.yesterday = yesterday
 
 class StructuralScanner:
-    def __init__(self, df, min_liquidity_pkr=10_000_000):
+    def __init__(self, df, min_liquidity_pkr=10_000_000, zone_clustering="legacy", indicators=None,
+                 annotate=True, buffers=None):
+        """
+        Args:
+            df (DataFrame): OHLCV history with lowercase columns.
+            min_liquidity_pkr (float): Minimum turnover (close * volume) for today's bar.
+            zone_clustering (str): 'legacy' (first-match loop, the alerting rule) or 'sorted'
+                (order-independent; opt-in, it can merge highs into different zones).
+            indicators (IndicatorState): Incremental indicator state already advanced to
+                df's last bar; evaluate_breakout then skips the full-frame recomputation.
+            annotate (bool): Write the indicator columns into df (legacy behaviour).
+                With False the scanner only reads read-only views of df's columns and
+                keeps the indicators in `metrics`; df is never copied or modified.
+            buffers (dict): Preallocated indicator arrays (allocate_metrics) for annotate=False.
+        """
         self.df = df
         self.min_liquidity = min_liquidity_pkr
+        self.zone_clustering = zone_clustering
+        self.indicators = indicators
+        self.annotate = annotate
+        self.buffers = buffers
+        self.metrics = None
+        self.index = df.index
+        self.columns = {name: _readonly(df[name].to_numpy()) for name in ('high', 'low', 'close', 'volume')}
+
+    def __len__(self):
+        return len(self.columns['close'])
 
     def _calculate_metrics(self):
         """Computes Technicals: ATR, Squeeze, Volume SMA."""
+        if not self.annotate:
+            cols = self.columns
+            self.metrics = compute_metrics(cols['high'], cols['low'], cols['close'], cols['volume'], self.buffers)
+            return
+
         # True Range
         self.df['tr'] = np.maximum(
             self.df['high'] - self.df['low'],
@@ -28,58 +452,105 @@ class StructuralScanner:
         
         # Volume SMA
         self.df['vol_sma_20'] = self.df['volume'].rolling(20).mean()
+        self.metrics = {name: self.df[name].to_numpy() for name in METRIC_COLUMNS}
 
-    def _find_structural_zones(self, lookback=250, tolerance=0.02):
+    def _bar(self, i):
+        """Bar i as a dict of prices (and indicators, once computed)."""
+        bar = {name: values[i] for name, values in self.columns.items()}
+        if self.metrics is not None:
+            bar.update((name, values[i]) for name, values in self.metrics.items())
+        return bar
+
+    def _find_structural_zones(self, lookback=250, tolerance=0.02, end=None):
         """
         Identifies horizontal zones with multiple touches using Fractal Highs.
+        `end` (exclusive bar index) replays the lookback window as of an earlier day.
         """
-        # Slice recent history
-        data = self.df.iloc[-lookback:].copy()
+        # Slice recent history (a view, nothing is copied)
+        if end is None:
+            end = len(self)
+        high = self.columns['high'][max(0, end - lookback):end]
         
         # Find local maxima (peaks)
         # order=5 means it's the highest point 5 days before and 5 days after
-        high_idx = argrelextrema(data['high'].values, np.greater_equal, order=5)[0]
-        highs = data.iloc[high_idx]['high']
-        
-        zones = []
+        high_idx = fractal_highs(high, order=5)
         
         # Cluster the highs
-        for price in highs:
-            matched = False
-            for i, zone in enumerate(zones):
-                # Check if price is within X% of an existing zone
-                if abs(zone['level'] - price) / zone['level'] <= tolerance:
-                    zones[i]['touches'] += 1
-                    # Keep the higher level to avoid false breakouts
-                    zones[i]['level'] = max(zones[i]['level'], price) 
-                    matched = True
-                    break
-            
-            if not matched:
-                zones.append({'level': price, 'touches': 1})
+        zones = _cluster_highs(high[high_idx], tolerance, self.zone_clustering)
 
-        # Filter: Only strong zones (3+ touches)
-        valid_zones = [z for z in zones if z['touches'] >= 3]
-        return sorted(valid_zones, key=lambda x: x['level'])
+        return _strong_zones(zones)
 
     def evaluate_breakout(self):
         """
         Main logic checks: Liquidity -> Structure -> Breakout -> Volume -> Context
         """
-        self._calculate_metrics()
-        
-        if len(self.df) < 25: return None
+        return self.scan().candidates
+
+    def scan(self):
+        """
+        Runs the evaluate_breakout checks and keeps what they computed.
+        Returns: ScanResult (candidates is None if today's bar was rejected before
+        the zone check, in which case no zones were built).
+        """
+        if len(self) < 25: return ScanResult(None, [], self.metrics)
         
-        today = self.df.iloc[-1]
-        yesterday = self.df.iloc[-2]
+        today, yesterday = self._latest_bars()
         
         # 1. Liquidity Check (Turnover > 10M PKR)
         if (today['close'] * today['volume']) < self.min_liquidity:
-            return None
+            return ScanResult(None, [], self.metrics, today, yesterday)
 
         zones = self._find_structural_zones()
-        breakout_candidates = []
+        candidates = self._match_zones(zones, today, yesterday)
+        return ScanResult(candidates, zones, self.metrics, today, yesterday)
 
+    def _latest_bars(self):
+        """Today's and yesterday's bar with their indicator values."""
+        state = self.indicators
+        if (state is not None and state.bars >= 2 and self.index is not None
+                and state.last_date == self.index[-1]):
+            today = dict(self._bar(-1), **state.latest)
+            yesterday = dict(self._bar(-2), **state.previous)
+            return today, yesterday
+
+        if self.metrics is None:
+            self._calculate_metrics()
+        return self._bar(-1), self._bar(-2)
+
+    def scan_history(self, start=0, end=None, lookback=250, tolerance=0.02, with_zones=False):
+        """
+        Vectorized replay of evaluate_breakout for every bar in [start, end).
+        Indicators are computed once for the whole frame and the zone-independent
+        checks run as boolean masks; zones are only built for the surviving bars,
+        from a WalkForwardZones cache shared across the replay.
+        Returns: Dictionary of {bar_index: breakout_candidates} (non-empty only).
+        With with_zones, also {bar_index: structural zones} for the same bars.
+        """
+        if self.metrics is None:
+            self._calculate_metrics()
+        n = len(self)
+        end = n if end is None else min(end, n)
+
+        mask = breakout_mask(self.columns['close'], self.columns['volume'], self.metrics,
+                             np.arange(n), self.min_liquidity)
+        mask[:start] = False
+        mask[end:] = False
+
+        walk = WalkForwardZones(self.columns['high'], lookback, tolerance, clustering=self.zone_clustering)
+        signals, signal_zones = {}, {}
+        for i in np.flatnonzero(mask):
+            zones = walk.zones(i + 1)
+            candidates = self._match_zones(zones, self._bar(i), self._bar(i - 1))
+            if candidates:
+                signals[int(i)] = candidates
+                signal_zones[int(i)] = zones
+        if with_zones:
+            return signals, signal_zones
+        return signals
+
+    def _match_zones(self, zones, today, yesterday):
+        """Applies the breakout commitment rules to every zone for one bar."""
+        breakout_candidates = []
         for zone in zones:
             level = zone['level']
             
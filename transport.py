@@ -0,0 +1,141 @@
+import random
+import time
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+# (connect, read) timeouts per host; anything else gets DEFAULT_TIMEOUT
+DEFAULT_TIMEOUTS = {
+    "api.telegram.org": (3.05, 10),
+    "api.openai.com": (3.05, 60),
+}
+DEFAULT_TIMEOUT = (3.05, 15)
+
+def _parse_duration(value):
+    """Parses OpenAI reset durations such as '20ms', '1s', '6m0s' into seconds."""
+    total, number = 0.0, ""
+    units = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+    i = 0
+    while i < len(value):
+        ch = value[i]
+        if ch.isdigit() or ch == ".":
+            number += ch
+            i += 1
+            continue
+        unit = "ms" if value[i:i + 2] == "ms" else ch
+        if unit not in units or not number:
+            return None
+        total += float(number) * units[unit]
+        number = ""
+        i += len(unit)
+    return total if not number else total + float(number)
+
+def retry_after_seconds(resp):
+    """
+    Server-requested wait before retrying, or None.
+    Understands Telegram's `parameters.retry_after` body field, `retry-after-ms`,
+    the standard Retry-After header (seconds or HTTP date) and OpenAI's
+    `x-ratelimit-reset-requests` / `x-ratelimit-reset-tokens` headers.
+    """
+    try:
+        retry_after = resp.json().get("parameters", {}).get("retry_after")
+        if retry_after is not None:
+            return float(retry_after)
+    except (ValueError, AttributeError):
+        pass
+
+    headers = resp.headers
+    if "retry-after-ms" in headers:
+        try:
+            return float(headers["retry-after-ms"]) / 1000
+        except ValueError:
+            pass
+    if "retry-after" in headers:
+        value = headers["retry-after"]
+        try:
+            return float(value)
+        except ValueError:
+            try:
+                return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+            except (TypeError, ValueError):
+                pass
+    resets = [_parse_duration(headers[h]) for h in ("x-ratelimit-reset-requests", "x-ratelimit-reset-tokens")
+              if h in headers]
+    resets = [r for r in resets if r is not None]
+    return max(resets) if resets else None
+
+def failed_before_sending(exc):
+    """True if the request never reached the server (connect timeout, refused connection, DNS failure)."""
+    if isinstance(exc, requests.ConnectTimeout):
+        return True
+    reason = getattr(exc.args[0], "reason", None) if exc.args else None
+    return isinstance(reason, NewConnectionError)
+
+class HttpTransport:
+    """
+    Shared HTTP client for Telegram and OpenAI.
+
+    One requests.Session with a keep-alive connection pool (DNS/TCP/TLS setup is
+    paid once per host, not per message), per-host timeouts, and bounded retries.
+    POSTs are not idempotent (a resent sendMessage is a duplicate alert, a resent
+    completion is billed twice), so by default only failures where the server did
+    not act are retried: connections that never opened, 429 and 503. Read
+    timeouts and 500/502/504 are only retried for calls marked idempotent.
+    A server-provided retry delay is honoured as given (up to `max_retry_after`,
+    beyond which the response is returned); otherwise the wait is exponential
+    backoff with full jitter.
+    """
+    RETRY_STATUSES = {429, 503}
+    IDEMPOTENT_RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+    def __init__(self, retries=3, backoff=0.5, max_backoff=30.0, timeouts=None, pool_size=10, sleep=time.sleep,
+                 max_retry_after=120.0):
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_retry_after = max_retry_after
+        self.timeouts = dict(DEFAULT_TIMEOUTS, **(timeouts or {}))
+        self.sleep = sleep
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def timeout_for(self, url):
+        return self.timeouts.get(urlparse(url).hostname, DEFAULT_TIMEOUT)
+
+    def _backoff_delay(self, attempt):
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def post_json(self, url, payload, headers=None, timeout=None, idempotent=False):
+        """
+        POSTs `payload` as JSON, retrying transient failures (see the class docstring;
+        `idempotent=True` also retries failures after the request may have been processed).
+        Returns the final response (which may still be an error status);
+        raises the last connection error if it could not be retried.
+        """
+        timeout = timeout or self.timeout_for(url)
+        retry_statuses = self.IDEMPOTENT_RETRY_STATUSES if idempotent else self.RETRY_STATUSES
+        for attempt in range(self.retries + 1):
+            try:
+                resp = self.session.post(url, json=payload, headers=headers, timeout=timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt == self.retries or not (idempotent or failed_before_sending(e)):
+                    raise
+                delay = self._backoff_delay(attempt)
+            else:
+                if resp.status_code not in retry_statuses or attempt == self.retries:
+                    return resp
+                delay = retry_after_seconds(resp)
+                if delay is None:
+                    delay = self._backoff_delay(attempt)
+                elif delay > self.max_retry_after:
+                    return resp # Retrying any sooner would only be rejected again
+            self.sleep(delay)
+
+    def close(self):
+        self.session.close()